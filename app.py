@@ -1,15 +1,484 @@
-from datetime import datetime, timedelta
+import base64
+import csv
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+import click
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, Response, stream_with_context, make_response, g, has_request_context
+from flask import before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from markupsafe import Markup
+from sqlalchemy import and_, or_, false, table, column, event, inspect, insert, select, update, delete
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload, aliased
 from werkzeug.security import generate_password_hash, check_password_hash
 
+
+def database_config(url):
+    """SQLAlchemy URI and engine options for DATABASE_URL; SQLite stays the zero-config default."""
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    if url.startswith('postgresql://'):
+        url = 'postgresql+psycopg://' + url[len('postgresql://'):]
+    if not url.startswith('postgresql'):
+        return url, {}
+    return url, {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        # drop connections the server or a proxy closed while they sat idle in the pool
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+
+
+def read_only_config(url):
+    """Bind for @read_only views: DATABASE_READ_URL (e.g. a replica), or the same SQLite file opened mode=ro."""
+    if os.environ.get('DATABASE_READ_URL'):
+        read_url, options = database_config(os.environ['DATABASE_READ_URL'])
+        return {'readonly': dict(options, url=read_url)}
+    parsed = make_url(url)
+    if parsed.get_backend_name() != 'sqlite' or parsed.database in (None, '', ':memory:') \
+            or parsed.query.get('uri'):
+        return {}
+    return {'readonly': {'url': f"sqlite:///file:{parsed.database}?mode=ro&uri=true"}}
+
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'Vishal@2007'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
+app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+    database_config(os.environ.get('DATABASE_URL', 'sqlite:///hospital.db'))
+app.config['SQLALCHEMY_BINDS'] = read_only_config(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# applied to every new SQLite connection; journal_mode only on the writable one
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL', 'memory://')
+app.config['CACHE_MAX_ENTRIES'] = 1024
+app.config['DIRECTORY_CACHE_TTL'] = 300
+app.config['FRAGMENT_CACHE'] = True
+app.config['FRAGMENT_CACHE_TTL'] = 600
+# rows each hot counter is spread over, so concurrent writes rarely wait on the same row lock
+app.config['COUNTER_SHARDS'] = 16
+# werkzeug method string incl. work factor; stored hashes with other parameters are upgraded at login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# per server process: every web worker starts its own pool, so keep this small
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+app.config['SLOW_QUERY_SECONDS'] = float(os.environ.get('SLOW_QUERY_SECONDS', 0.25))
+app.config['STATSD_HOST'] = os.environ.get('STATSD_HOST')
+app.config['STATSD_PORT'] = int(os.environ.get('STATSD_PORT', 8125))
+# redis:// fans appointment events out to every worker process; otherwise only within this process
+app.config['EVENTS_URL'] = os.environ.get('EVENTS_URL', app.config['CACHE_URL'])
+# the SSE feed holds one connection per open dashboard: only for gevent workers, see README
+app.config['LIVE_UPDATES'] = os.environ.get('LIVE_UPDATES') == '1'
+app.config['FEED_KEEPALIVE_SECONDS'] = 15
+# set when a `flask worker` process runs the job queue; otherwise admin actions do the work inline
+app.config['BACKGROUND_JOBS'] = os.environ.get('BACKGROUND_JOBS') == '1'
+app.config['JOB_BACKOFF_SECONDS'] = 10
+app.config['JOB_MAX_BACKOFF_SECONDS'] = 3600
+# a running job whose worker has not finished it within this time is handed to another worker
+app.config['JOB_LOCK_TIMEOUT_SECONDS'] = 600
+app.config['AVAILABILITY_RETENTION_DAYS'] = 30
+# closed appointments older than this move to appointment_archive
+app.config['ARCHIVE_HORIZON_DAYS'] = int(os.environ.get('ARCHIVE_HORIZON_DAYS', 365))
+app.config['ARCHIVE_BATCH_SIZE'] = 1000
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify() through orjson; same sorted keys and date handling as Flask's default, several times faster."""
+
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        body = orjson.dumps(self._prepare_response_obj(args, kwargs), default=self.default,
+                            option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+if orjson:
+    app.json = OrjsonProvider(app)
+
+
+class RoutingSession(Session):
+    """Sends reads from @read_only views to the 'readonly' bind; flushes and DML always use the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('read_only') \
+                and not getattr(clause, 'is_dml', False) and 'readonly' in self._db.engines:
+            return self._db.engines['readonly']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record, read_only=False):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        if read_only and name == 'journal_mode':
+            continue
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+with app.app_context():
+    for bind_key, engine in db.engines.items():
+        event.listen(engine, 'connect',
+                     lambda conn, record, ro=(bind_key == 'readonly'): apply_sqlite_pragmas(conn, record, ro))
+
+
+class MemoryCache:
+    """Per-process cache with a TTL per entry and least-recently-used eviction."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+class RedisCache:
+    """Shared cache for all workers; eviction is left to the server's maxmemory-policy (allkeys-lru)."""
+
+    def __init__(self, client, prefix='hms:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
 
-db = SQLAlchemy(app)
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+
+def make_cache(url):
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        import redis
+        return RedisCache(redis.Redis.from_url(url))
+    return MemoryCache(app.config['CACHE_MAX_ENTRIES'])
+
+
+cache = make_cache(app.config['CACHE_URL'])
+
+
+class AppointmentFeed:
+    """Fans committed appointment events out to the open SSE streams, filtered by doctor or department.
+
+    Each stream owns a bounded queue; a client that stops reading misses events instead of
+    blocking the request that published them.
+    """
+
+    def __init__(self, client=None, channel='hms:appointment-events', max_queue=100, max_backoff=30):
+        self.client = client
+        self.channel = channel
+        self.max_queue = max_queue
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.listener = None
+
+    def publish(self, events):
+        if self.client is None:
+            self.dispatch(events)
+            return
+        for e in events:
+            self.client.publish(self.channel, json.dumps(e))
+
+    def dispatch(self, events):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            q, doctor_id, department_id = subscription
+            for e in events:
+                if doctor_id not in (None, e['doctor_id']) or department_id not in (None, e['department_id']):
+                    continue
+                try:
+                    q.put_nowait(e)
+                except queue.Full:
+                    pass
+
+    def subscribe(self, doctor_id=None, department_id=None):
+        subscription = (queue.Queue(self.max_queue), doctor_id, department_id)
+        with self.lock:
+            self.subscribers.add(subscription)
+            if self.client is not None and self.listener is None:
+                self.listener = threading.Thread(target=self.listen, daemon=True)
+                self.listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def listen(self):
+        # runs for the life of the process: a dropped connection is retried with backoff, since
+        # subscribe() never starts a second listener and the open streams would go silent
+        delay = 1
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                delay = 1
+                for message in pubsub.listen():
+                    self.dispatch([json.loads(message['data'])])
+                app.logger.warning("appointment feed subscription ended; resubscribing in %ss", delay)
+            except Exception:
+                app.logger.exception("appointment feed subscription failed; resubscribing in %ss", delay)
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+
+def make_feed(url):
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        import redis
+        return AppointmentFeed(redis.Redis.from_url(url))
+    return AppointmentFeed()
+
+
+feed = make_feed(app.config['EVENTS_URL'])
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs password hashing in a bounded process pool so request threads only wait on a future.
+
+    workers=0 hashes inline, which is handy for the CLI and the shell. The pool's children start
+    fresh and re-import the main script, so a script that hashes at import time needs a
+    `if __name__ == '__main__':` guard or PASSWORD_HASH_WORKERS=0.
+    """
+
+    def __init__(self, method, workers, max_pending):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.pool = None
+        self.prefix = None
+
+    @property
+    def queue_depth(self):
+        return self.pending
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # created lazily so each forked server worker gets its own pool; forking a threaded
+                # server could copy a lock held by another thread, so the children start clean
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context(method))
+            return self.pool
+
+    def discard_pool(self, pool):
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise HashingBusy()
+            self.pending += 1
+        try:
+            pool = self.get_pool()
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                # a child died (OOM kill, SIGKILL) and the pool refuses all further work: retry once on a new one
+                app.logger.warning("password hashing pool broke; starting a new one")
+                self.discard_pool(pool)
+                return self.get_pool().submit(func, *args).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify(self, hashed, password):
+        return self.run(check_password_hash, hashed, password)
+
+    def needs_rehash(self, hashed):
+        # werkzeug stores the full parameters ('scrypt' -> 'scrypt:32768:8:1'), so compare with a real hash
+        if self.prefix is None:
+            self.prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return hashed.split('$', 1)[0] != self.prefix
+
+
+hasher = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+                        app.config['PASSWORD_HASH_MAX_PENDING'])
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    return "Server is busy, please try again in a moment.", 503, {'Retry-After': '2'}
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """Per-endpoint latency histograms and SQL totals for this process, rendered as Prometheus text."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def observe(self, endpoint, seconds, sql_count, db_seconds):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'sql': 0, 'db': 0.0,
+            })
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['sql'] += sql_count
+            stats['db'] += db_seconds
+
+    def render(self):
+        lines = [
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for endpoint, stats in endpoints:
+                for bound, count in zip(self.buckets, stats['buckets']):
+                    lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats["sum"]:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{endpoint="{endpoint}"}} {stats["count"]}')
+            lines.append('# TYPE http_request_sql_statements_total counter')
+            lines.extend(f'http_request_sql_statements_total{{endpoint="{e}"}} {s["sql"]}' for e, s in endpoints)
+            lines.append('# TYPE http_request_db_seconds_total counter')
+            lines.extend(f'http_request_db_seconds_total{{endpoint="{e}"}} {s["db"]:.6f}' for e, s in endpoints)
+        lines.append('# TYPE password_hash_queue_depth gauge')
+        lines.append(f'password_hash_queue_depth {hasher.queue_depth}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = RequestMetrics(LATENCY_BUCKETS)
+statsd_client = None
+if app.config['STATSD_HOST']:
+    import statsd
+    statsd_client = statsd.StatsClient(app.config['STATSD_HOST'], app.config['STATSD_PORT'], prefix='hms')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+    if elapsed >= app.config['SLOW_QUERY_SECONDS']:
+        app.logger.warning("slow query (%.3fs): %s; parameters=%r", elapsed, statement, parameters)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe(endpoint, elapsed, g.get('sql_count', 0), g.get('db_seconds', 0.0))
+    if statsd_client:
+        statsd_client.timing(f"request.{endpoint}", elapsed * 1000)
+        statsd_client.incr(f"request.{endpoint}.sql", g.get('sql_count', 0))
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 
@@ -24,7 +493,7 @@ class User(db.Model):
 
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     full_name = db.Column(db.String(100), nullable=False)
     age = db.Column(db.Integer)
     gender = db.Column(db.String(10))
@@ -50,7 +519,7 @@ class Department(db.Model):
 
 class Doctor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     full_name = db.Column(db.String(100), nullable=False)
     specialization_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
     phone = db.Column(db.String(15))
@@ -65,6 +534,12 @@ class Doctor(db.Model):
 
 
 class DoctorAvailability(db.Model):
+    __table_args__ = (
+        db.Index('ix_availability_doctor_date', 'doctor_id', 'date'),
+        # ids move to doctor_availability_archive, so SQLite must not hand them out again
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -73,8 +548,53 @@ class DoctorAvailability(db.Model):
     is_available = db.Column(db.Boolean, default=True)
 
 
+# A weekly rota: one row stands for every matching day between valid_from and valid_until,
+# expanded into windows only when slots are read.
+class AvailabilityRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False, index=True)
+    weekdays = db.Column(db.Integer, nullable=False)  # bit 0 = Monday ... bit 6 = Sunday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    valid_from = db.Column(db.Date, nullable=False)
+    valid_until = db.Column(db.Date)  # open-ended when NULL
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    exceptions = db.relationship('AvailabilityException', backref='rule', lazy=True,
+                                 cascade='all, delete-orphan', order_by='AvailabilityException.date')
+
+    def weekday_names(self):
+        return [WEEKDAYS[i] for i in range(7) if self.weekdays & (1 << i)]
+
+
+# Days a rule does not apply, e.g. leave or a public holiday.
+class AvailabilityException(db.Model):
+    __table_args__ = (db.UniqueConstraint('rule_id', 'date'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('availability_rule.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+
+
 
 class Appointment(db.Model):
+    __table_args__ = (
+        # doctor views: one doctor's appointments by date, optionally by status
+        db.Index('ix_appointment_doctor_date_status', 'doctor_id', 'appointment_date', 'status'),
+        # patient views: upcoming/completed visits of one patient by date
+        db.Index('ix_appointment_patient_status_date', 'patient_id', 'status', 'appointment_date'),
+        # admin listing and API pagination, both ordered by (appointment_date, id)
+        db.Index('ix_appointment_date', 'appointment_date'),
+        db.Index('ix_appointment_created_at', 'created_at'),
+        # a doctor slot can hold at most one live booking; cancelled rows free it again
+        db.Index('uq_appointment_doctor_slot', 'doctor_id', 'appointment_date', 'appointment_time',
+                 unique=True,
+                 sqlite_where=db.text("status != 'Cancelled'"),
+                 postgresql_where=db.text("status != 'Cancelled'")),
+        # ids move to appointment_archive, so SQLite must not hand them out again
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
@@ -89,16 +609,796 @@ class Appointment(db.Model):
 
 
 class Treatment(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
-    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False, index=True)
+    diagnosis = db.Column(db.Text)
+    prescription = db.Column(db.Text)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+# Read model for the history pages: one row per completed visit with the doctor, department and
+# treatment copied in, so a patient's history is a single range scan on (patient_id, date).
+# Written in the same transaction as the completion; `flask rebuild-history` regenerates it.
+# No foreign key: the visit may live in appointment or appointment_archive.
+class PatientHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_patient_history_patient_date', 'patient_id', 'appointment_date', 'appointment_id'),
+    )
+
+    appointment_id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer, nullable=False)
+    appointment_date = db.Column(db.Date, nullable=False)
+    appointment_time = db.Column(db.Time, nullable=False)
+    doctor_name = db.Column(db.String(100))
+    department_name = db.Column(db.String(100))
+    diagnosis = db.Column(db.Text)
+    prescription = db.Column(db.Text)
+    notes = db.Column(db.Text)
+    completed_at = db.Column(db.DateTime)
+
+
+# Closed appointments past ARCHIVE_HORIZON_DAYS, moved out by `flask archive` with their ids kept,
+# so the live tables and their indexes only hold recent and upcoming visits.
+class ArchivedAppointment(db.Model):
+    __tablename__ = 'appointment_archive'
+    __table_args__ = (
+        db.Index('ix_appointment_archive_patient_date', 'patient_id', 'appointment_date'),
+        db.Index('ix_appointment_archive_doctor_date', 'doctor_id', 'appointment_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer, nullable=False)
+    appointment_date = db.Column(db.Date, nullable=False)
+    appointment_time = db.Column(db.Time, nullable=False)
+    status = db.Column(db.String(20))
+    reason = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+
+class ArchivedTreatment(db.Model):
+    __tablename__ = 'treatment_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    appointment_id = db.Column(db.Integer, nullable=False, index=True)
     diagnosis = db.Column(db.Text)
     prescription = db.Column(db.Text)
     notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+
+
+class ArchivedAvailability(db.Model):
+    __tablename__ = 'doctor_availability_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    doctor_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    is_available = db.Column(db.Boolean)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+
+# Deferred work, run by `flask worker`. Jobs are added to the caller's session, so they are only
+# visible to workers once the request that queued them commits.
+class Job(db.Model):
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime)
+
+
+# Next due time of each periodic job; whichever worker advances it first enqueues the run.
+class JobSchedule(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    next_run_at = db.Column(db.DateTime, nullable=False)
+
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.now)
+
+
+# Bumped on every committed change to a table; API ETags and Last-Modified are derived from these.
+# Sharded like DashboardStat: a table's version is the sum of its rows, updated_at the latest of them.
+class TableVersion(db.Model):
+    name = db.Column(db.String(40), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
 
+# Admin dashboard counters: 'active_doctors', 'active_patients', 'appointments',
+# plus one 'booked:<date>' row per day holding that day's Booked appointments.
+# A counter is the sum of its shard rows; each writer adds its deltas to one shard.
+class DashboardStat(db.Model):
+    key = db.Column(db.String(40), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, default=0)
+    value = db.Column(db.Integer, nullable=False, default=0)
 
 
 
+# Relationships each listing needs, loaded up front instead of one lazy SELECT per row.
+APPOINTMENT_LOADS = {
+    'patient': lambda: joinedload(Appointment.patient),
+    'doctor': lambda: joinedload(Appointment.doctor),
+    'department': lambda: joinedload(Appointment.doctor).joinedload(Doctor.department),
+    'treatment': lambda: selectinload(Appointment.treatment),
+}
+
+
+def appointment_query(*relations):
+    return Appointment.query.options(*[APPOINTMENT_LOADS[name]() for name in relations])
+
+
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 200
+
+
+class Listing:
+    """One page of an admin list plus what the templates need to link to other pages."""
+
+    def __init__(self, items, per_page, sort=None, direction='asc', page=None, total=None,
+                 has_next=False, next_args=None):
+        self.items = items
+        self.per_page = per_page
+        self.sort = sort
+        self.direction = direction
+        self.page = page
+        self.total = total
+        self.has_next = has_next
+        self.next_args = next_args or {'page': (page or 1) + 1}
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return max((self.total + self.per_page - 1) // self.per_page, 1)
+
+    @property
+    def has_prev(self):
+        return (self.page or 1) > 1
+
+    def url(self, **changes):
+        args = request.args.to_dict()
+        args.update(changes)
+        args = {k: v for k, v in args.items() if v is not None}
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    def next_url(self):
+        return self.url(**self.next_args)
+
+    def prev_url(self):
+        return self.url(page=self.page - 1)
+
+    def first_url(self):
+        return self.url(page=None, after=None)
+
+    def sort_url(self, key):
+        direction = 'desc' if key == self.sort and self.direction == 'asc' else 'asc'
+        return self.url(sort=key, dir=direction, page=None, after=None)
+
+
+def page_args():
+    per_page = request.args.get('per_page', ADMIN_PAGE_SIZE, type=int)
+    direction = 'desc' if request.args.get('dir') == 'desc' else 'asc'
+    return min(max(per_page, 1), ADMIN_MAX_PAGE_SIZE), direction
+
+
+def paginate(query, sort_columns, default_sort, count=True):
+    """Offset pagination; count=False skips the COUNT(*) and only knows whether a next page exists.
+
+    An explicit ?sort= replaces any order the query already has (search rank); the default sort
+    only breaks its ties.
+    """
+    per_page, direction = page_args()
+    page = max(request.args.get('page', 1, type=int), 1)
+    sort = request.args.get('sort')
+    if sort in sort_columns:
+        query = query.order_by(None)
+    else:
+        sort = default_sort
+
+    column = sort_columns[sort]
+    # the primary key breaks ties so rows never repeat or vanish between pages
+    key = query.column_descriptions[0]['entity'].id
+    total = query.order_by(None).count() if count else None
+    rows = query.order_by(column.desc() if direction == 'desc' else column.asc(), key) \
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
+    return Listing(rows[:per_page], per_page, sort=sort, direction=direction, page=page,
+                   total=total, has_next=len(rows) > per_page)
+
+
+def encode_cursor(appointment_date, appointment_id):
+    raw = f"{appointment_date.isoformat()}|{appointment_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_str, id_str = raw.split('|')
+        return datetime.strptime(date_str, '%Y-%m-%d').date(), int(id_str)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+
+
+def appointments_after(cursor, descending=False):
+    after_date, after_id = decode_cursor(cursor)
+    if descending:
+        return or_(
+            Appointment.appointment_date < after_date,
+            and_(Appointment.appointment_date == after_date, Appointment.id < after_id)
+        )
+    return or_(
+        Appointment.appointment_date > after_date,
+        and_(Appointment.appointment_date == after_date, Appointment.id > after_id)
+    )
+
+
+def paginate_appointments(query, total=None):
+    """Keyset pagination on (appointment_date, id), so deep pages cost the same as the first."""
+    per_page, _ = page_args()
+    direction = 'asc' if request.args.get('dir') == 'asc' else 'desc'
+    descending = direction == 'desc'
+
+    after = request.args.get('after')
+    if after:
+        try:
+            query = query.filter(appointments_after(after, descending))
+        except ValueError:
+            abort(400)
+
+    order = (Appointment.appointment_date.desc(), Appointment.id.desc()) if descending \
+        else (Appointment.appointment_date, Appointment.id)
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_args = {'after': encode_cursor(items[-1].appointment_date, items[-1].id)} if items else None
+    return Listing(items, per_page, sort='date', direction=direction, total=total,
+                   has_next=len(rows) > per_page, next_args=next_args)
+
+
+HISTORY_FIELDS = ('appointment_id', 'patient_id', 'doctor_id', 'appointment_date', 'appointment_time',
+                  'doctor_name', 'department_name', 'diagnosis', 'prescription', 'notes', 'completed_at')
+HISTORY_REBUILD_BATCH = 50000
+
+
+def history_source(appointments=None, treatments=None):
+    """Completed appointments shaped like PatientHistory rows; the latest Treatment wins if there are several.
+
+    Reads the live tables by default, or the archive pair when given ArchivedAppointment/ArchivedTreatment.
+    """
+    appointments = appointments or Appointment
+    treatments = treatments or Treatment
+    latest_treatment = select(db.func.max(treatments.id)) \
+        .where(treatments.appointment_id == appointments.id).correlate(appointments).scalar_subquery()
+    return select(
+        appointments.id, appointments.patient_id, appointments.doctor_id, appointments.appointment_date,
+        appointments.appointment_time, Doctor.full_name, Department.name, treatments.diagnosis,
+        treatments.prescription, treatments.notes, treatments.created_at
+    ).join(Doctor, appointments.doctor_id == Doctor.id) \
+     .join(Department, Doctor.specialization_id == Department.id) \
+     .outerjoin(treatments, treatments.id == latest_treatment) \
+     .where(appointments.status == 'Completed')
+
+
+def refresh_history(condition):
+    """(Re)write the history rows of the completed appointments matching condition."""
+    db.session.execute(delete(PatientHistory).where(
+        PatientHistory.appointment_id.in_(select(Appointment.id).where(condition))))
+    db.session.execute(insert(PatientHistory).from_select(HISTORY_FIELDS, history_source().where(condition)))
+
+
+@event.listens_for(db.session.session_factory.class_, 'after_flush')
+def drop_reopened_history(session, flush_context):
+    # a visit that stops being Completed, e.g. cancelled afterwards, leaves the history pages
+    ids = [obj.id for obj in session.dirty if isinstance(obj, Appointment)
+           and attr_value(obj, 'status', old=True) == 'Completed' and obj.status != 'Completed']
+    ids += [obj.id for obj in session.deleted if isinstance(obj, Appointment)]
+    if ids:
+        session.connection().execute(delete(PatientHistory).where(PatientHistory.appointment_id.in_(ids)))
+
+
+def rebuild_patient_history(patient_id=None):
+    """Regenerate the read model from the live and the archived appointments."""
+    stores = ((Appointment, Treatment), (ArchivedAppointment, ArchivedTreatment))
+    if patient_id is not None:
+        db.session.execute(delete(PatientHistory).where(PatientHistory.patient_id == patient_id))
+        for appointments, treatments in stores:
+            db.session.execute(insert(PatientHistory).from_select(HISTORY_FIELDS, history_source(
+                appointments, treatments).where(appointments.patient_id == patient_id)))
+        db.session.commit()
+        return
+    db.session.execute(delete(PatientHistory))
+    for appointments, treatments in stores:
+        last_id = db.session.query(db.func.max(appointments.id)).scalar() or 0
+        for start in range(0, last_id, HISTORY_REBUILD_BATCH):
+            db.session.execute(insert(PatientHistory).from_select(HISTORY_FIELDS, history_source(
+                appointments, treatments).where(appointments.id > start,
+                                                appointments.id <= start + HISTORY_REBUILD_BATCH)))
+    db.session.commit()
+
+
+def paginate_history(patient_id):
+    """Newest-first keyset pages of one patient's history."""
+    per_page, _ = page_args()
+    query = PatientHistory.query.filter(PatientHistory.patient_id == patient_id)
+    after = request.args.get('after')
+    if after:
+        try:
+            after_date, after_id = decode_cursor(after)
+        except ValueError:
+            abort(400)
+        query = query.filter(or_(
+            PatientHistory.appointment_date < after_date,
+            and_(PatientHistory.appointment_date == after_date, PatientHistory.appointment_id < after_id)
+        ))
+    rows = query.order_by(PatientHistory.appointment_date.desc(), PatientHistory.appointment_id.desc()) \
+        .limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_args = {'after': encode_cursor(items[-1].appointment_date, items[-1].appointment_id)} if items else None
+    return Listing(items, per_page, sort='date', direction='desc', has_next=len(rows) > per_page,
+                   next_args=next_args)
+
+
+SLOT_MINUTES = 30
+BOOKING_WINDOW_DAYS = 7
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+WEEKDAY_VALUES = {str(day) for day in range(7)}
+
+
+def to_minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_booked(windows, booked):
+    # both lists are merged and sorted, so one pass with a pointer into booked is enough
+    slots = []
+    i = 0
+    for start, end in windows:
+        for t in range(start, end - SLOT_MINUTES + 1, SLOT_MINUTES):
+            while i < len(booked) and booked[i][1] <= t:
+                i += 1
+            if i < len(booked) and booked[i][0] < t + SLOT_MINUTES:
+                continue
+            slots.append(t)
+    return slots
+
+
+# FTS5 indexes maintained by triggers (migration 3); other backends keep the LIKE search.
+doctor_search = table('doctor_search', column('rowid'), column('rank'))
+patient_search = table('patient_search', column('rowid'), column('rank'))
+
+
+def search_index_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def fts_query(term):
+    # every word must match, each as a prefix: "car ped" -> "car"* "ped"*
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', term))
+
+
+def search_doctors(query, term):
+    if not search_index_enabled():
+        return query.filter(
+            (Doctor.full_name.icontains(term)) |
+            (Doctor.department.has(Department.name.icontains(term)))
+        )
+    match = fts_query(term)
+    if not match:
+        return query.filter(false())
+    return query.join(doctor_search, doctor_search.c.rowid == Doctor.id) \
+        .filter(db.text('doctor_search MATCH :doctor_match').bindparams(doctor_match=match)) \
+        .order_by(doctor_search.c.rank)
+
+
+def search_patients(query, term):
+    if not search_index_enabled():
+        return query.filter(
+            (Patient.full_name.icontains(term)) |
+            (Patient.phone.contains(term))
+        )
+    match = fts_query(term)
+    if not match:
+        return query.filter(false())
+    return query.join(patient_search, patient_search.c.rowid == Patient.id) \
+        .filter(db.text('patient_search MATCH :patient_match').bindparams(patient_match=match)) \
+        .order_by(patient_search.c.rank)
+
+
+# The queries behind free_slots, kept apart so check-query-plans explains exactly these shapes.
+
+def rule_windows_query(doctor_ids, start_date, end_date):
+    return db.session.query(
+        AvailabilityRule.id, AvailabilityRule.doctor_id, AvailabilityRule.weekdays,
+        AvailabilityRule.start_time, AvailabilityRule.end_time,
+        AvailabilityRule.valid_from, AvailabilityRule.valid_until, AvailabilityException.date
+    ).outerjoin(AvailabilityException, and_(
+        AvailabilityException.rule_id == AvailabilityRule.id,
+        AvailabilityException.date.between(start_date, end_date)
+    )).filter(
+        AvailabilityRule.doctor_id.in_(doctor_ids),
+        AvailabilityRule.valid_from <= end_date,
+        or_(AvailabilityRule.valid_until.is_(None), AvailabilityRule.valid_until >= start_date)
+    )
+
+
+def availability_windows_query(doctor_ids, start_date, end_date):
+    return db.session.query(
+        DoctorAvailability.doctor_id, DoctorAvailability.date,
+        DoctorAvailability.start_time, DoctorAvailability.end_time
+    ).filter(
+        DoctorAvailability.doctor_id.in_(doctor_ids),
+        DoctorAvailability.date >= start_date,
+        DoctorAvailability.date <= end_date,
+        DoctorAvailability.is_available == True
+    )
+
+
+def booked_slots_query(doctor_ids, start_date, end_date):
+    return db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time
+    ).filter(
+        Appointment.doctor_id.in_(doctor_ids),
+        Appointment.appointment_date >= start_date,
+        Appointment.appointment_date <= end_date,
+        Appointment.status != 'Cancelled'
+    )
+
+
+def rule_windows(doctor_ids, start_date, end_date):
+    """Expand the weekly rules into {(doctor_id, day): [(start, end)]} minutes for the given dates."""
+    rules = {}
+    for rule_id, doctor_id, weekdays, start, end, valid_from, valid_until, skipped in \
+            rule_windows_query(doctor_ids, start_date, end_date):
+        rule = rules.setdefault(rule_id, (doctor_id, weekdays, to_minutes(start), to_minutes(end),
+                                          max(valid_from, start_date), min(valid_until or end_date, end_date), set()))
+        if skipped:
+            rule[6].add(skipped)
+
+    windows = {}
+    for doctor_id, weekdays, start, end, first, last, skipped in rules.values():
+        day = first
+        while day <= last:
+            if weekdays & (1 << day.weekday()) and day not in skipped:
+                windows.setdefault((doctor_id, day), []).append((start, end))
+            day += timedelta(days=1)
+    return windows
+
+
+def free_slots(doctor_ids, start_date, end_date):
+    """Bookable slot datetimes per doctor, from three queries however many doctors are asked for."""
+    doctor_ids = list(doctor_ids)
+    booked = {}
+    if not doctor_ids:
+        return {}
+
+    windows = rule_windows(doctor_ids, start_date, end_date)
+    for doctor_id, day, start, end in availability_windows_query(doctor_ids, start_date, end_date):
+        windows.setdefault((doctor_id, day), []).append((to_minutes(start), to_minutes(end)))
+
+    for doctor_id, day, at in booked_slots_query(doctor_ids, start_date, end_date):
+        minute = to_minutes(at)
+        booked.setdefault((doctor_id, day), []).append((minute, minute + SLOT_MINUTES))
+
+    now = datetime.now()
+    result = {doctor_id: [] for doctor_id in doctor_ids}
+    for (doctor_id, day), day_windows in sorted(windows.items()):
+        day_start = datetime.combine(day, datetime.min.time())
+        for minute in subtract_booked(merge_intervals(day_windows),
+                                      merge_intervals(booked.get((doctor_id, day), []))):
+            slot = day_start + timedelta(minutes=minute)
+            if slot > now:
+                result[doctor_id].append(slot)
+    return result
+
+
+def read_through(key, loader, ttl):
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        cache.set(key, value, ttl)
+    return value
+
+
+# Cached values are plain dicts so every backend can store them; templates read them like models.
+# Keys carry the table versions like cached_fragment, so a write in any process retires them everywhere.
+def cached_departments():
+    return read_through(f"departments:{'-'.join(map(str, table_versions(['department'])))}", lambda: [
+        {'id': d.id, 'name': d.name, 'description': d.description}
+        for d in Department.query.order_by(Department.id)
+    ], app.config['DIRECTORY_CACHE_TTL'])
+
+
+def cached_doctor_directory():
+    return read_through(f"doctors:active:{'-'.join(map(str, table_versions(['doctor', 'department'])))}", lambda: [{
+        'id': d.id,
+        'name': d.full_name,
+        'specialization': d.specialization,
+        'phone': d.phone,
+        'experience': d.experience_years
+    } for d in db.session.execute(
+        select(Doctor.id, Doctor.full_name, Department.name.label('specialization'),
+               Doctor.phone, Doctor.experience_years)
+        .join(Department, Doctor.specialization_id == Department.id)
+        .where(Doctor.is_active == True)
+        .order_by(Doctor.id))],
+        app.config['DIRECTORY_CACHE_TTL'])
+
+
+def booked_key(day):
+    return f"booked:{day.isoformat()}"
+
+
+def attr_value(obj, attr, old):
+    history = inspect(obj).attrs[attr].history
+    if old and history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+
+def stat_keys(obj, old=False):
+    # column defaults are not applied yet for new rows, so None means the default
+    if isinstance(obj, Doctor):
+        return ['active_doctors'] if attr_value(obj, 'is_active', old) is not False else []
+    if isinstance(obj, Patient):
+        return ['active_patients'] if attr_value(obj, 'is_active', old) is not False else []
+    if isinstance(obj, Appointment):
+        keys = ['appointments', 'live_appointments']
+        if attr_value(obj, 'status', old) in (None, 'Booked'):
+            keys.append(booked_key(attr_value(obj, 'appointment_date', old)))
+        return keys
+    return []
+
+
+@event.listens_for(db.session.session_factory.class_, 'after_flush')
+def update_dashboard_stats(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        deltas.update(stat_keys(obj))
+    for obj in session.deleted:
+        deltas.subtract(stat_keys(obj, old=True))
+    for obj in session.dirty:
+        deltas.update(stat_keys(obj))
+        deltas.subtract(stat_keys(obj, old=True))
+
+    add_dashboard_stats(session.connection(), deltas)
+
+
+def counter_shard(conn):
+    # fixed per pooled connection: a transaction always writes the same shard rows,
+    # while concurrent transactions, on other connections, mostly write different ones
+    return conn.info.setdefault('counter_shard', random.randrange(app.config['COUNTER_SHARDS']))
+
+
+def add_dashboard_stats(conn, deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    insert = postgresql.insert if conn.dialect.name == 'postgresql' else sqlite.insert
+    shard = counter_shard(conn)
+    for key, delta in sorted(deltas.items()):
+        stmt = insert(DashboardStat).values(key=key, shard=shard, value=delta)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=['key', 'shard'], set_={'value': DashboardStat.value + delta}))
+
+
+VERSIONED_TABLES = {'user', 'patient', 'department', 'doctor', 'doctor_availability', 'availability_rule',
+                    'availability_exception', 'appointment', 'treatment'}
+
+
+def bump_table_versions(conn, names):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    insert = postgresql.insert if conn.dialect.name == 'postgresql' else sqlite.insert
+    shard = counter_shard(conn)
+    for name in sorted(names):
+        stmt = insert(TableVersion).values(name=name, shard=shard, version=1, updated_at=now)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=['name', 'shard'], set_={'version': TableVersion.version + 1, 'updated_at': now}))
+
+
+def read_table_versions(tables):
+    """{name: (version, updated_at)} for the tables that have been written to."""
+    return {name: (version, updated_at) for name, version, updated_at in db.session.query(
+        TableVersion.name, db.func.sum(TableVersion.version), db.func.max(TableVersion.updated_at)
+    ).filter(TableVersion.name.in_(tables)).group_by(TableVersion.name)}
+
+
+@event.listens_for(db.session.session_factory.class_, 'after_flush')
+def update_table_versions(session, flush_context):
+    changed = {obj.__tablename__ for obj in session.new | session.deleted}
+    changed.update(obj.__tablename__ for obj in session.dirty if session.is_modified(obj))
+    changed &= VERSIONED_TABLES
+    if changed:
+        bump_table_versions(session.connection(), changed)
+
+
+FEED_EVENT_TYPES = {'Booked': 'booked', 'Cancelled': 'cancelled', 'Completed': 'completed', 'No-show': 'no-show'}
+
+
+def queue_appointment_events(session, changes):
+    """Hold (id, doctor_id, date, status) changes on the session until its transaction commits."""
+    if not app.config['LIVE_UPDATES']:
+        return
+    changes = [c for c in changes if c[3] in FEED_EVENT_TYPES]
+    if not changes:
+        return
+    departments = dict(session.connection().execute(
+        select(Doctor.id, Doctor.specialization_id).where(Doctor.id.in_({c[1] for c in changes}))).all())
+    session.info.setdefault('appointment_events', []).extend({
+        'type': FEED_EVENT_TYPES[status],
+        'appointment_id': appointment_id,
+        'doctor_id': doctor_id,
+        'department_id': departments.get(doctor_id),
+        'date': day.isoformat(),
+    } for appointment_id, doctor_id, day, status in changes)
+
+
+@event.listens_for(db.session.session_factory.class_, 'after_flush')
+def collect_appointment_events(session, flush_context):
+    if not app.config['LIVE_UPDATES']:
+        return
+    changes = [obj for obj in session.new if isinstance(obj, Appointment)]
+    changes += [obj for obj in session.dirty
+                if isinstance(obj, Appointment) and inspect(obj).attrs['status'].history.has_changes()]
+    queue_appointment_events(session, [
+        (obj.id, obj.doctor_id, obj.appointment_date, obj.status or 'Booked') for obj in changes])
+
+
+@event.listens_for(db.session.session_factory.class_, 'after_commit')
+def publish_appointment_events(session):
+    events = session.info.pop('appointment_events', None)
+    if not events:
+        return
+    # the transaction is already committed: a feed outage must not turn the write into an error
+    try:
+        feed.publish(events)
+    except Exception:
+        app.logger.exception("could not publish %s appointment events", len(events))
+
+
+@event.listens_for(db.session.session_factory.class_, 'after_rollback')
+def drop_appointment_events(session):
+    session.info.pop('appointment_events', None)
+
+
+def recompute_dashboard_stats():
+    today = datetime.now().date()
+    DashboardStat.query.delete()
+    stats = {
+        'active_doctors': Doctor.query.filter_by(is_active=True).count(),
+        'active_patients': Patient.query.filter_by(is_active=True).count(),
+        # archived appointments still count towards the all-time total
+        'appointments': Appointment.query.count() + ArchivedAppointment.query.count(),
+        'live_appointments': Appointment.query.count(),
+    }
+    for day, count in db.session.query(Appointment.appointment_date, db.func.count()).filter(
+        Appointment.appointment_date >= today,
+        Appointment.status == 'Booked'
+    ).group_by(Appointment.appointment_date):
+        stats[booked_key(day)] = count
+    db.session.add_all(DashboardStat(key=key, value=value) for key, value in stats.items())
+    db.session.commit()
+
+
+def read_dashboard_stats():
+    today = datetime.now().date()
+    stats = dict(db.session.query(DashboardStat.key, db.func.sum(DashboardStat.value)).filter(or_(
+        DashboardStat.key.in_(['active_doctors', 'active_patients', 'appointments', 'live_appointments']),
+        DashboardStat.key.between(booked_key(today), 'booked:9999-12-31')
+    )).group_by(DashboardStat.key).all())
+    return {
+        'total_doctors': stats.get('active_doctors', 0),
+        'total_patients': stats.get('active_patients', 0),
+        'total_appointments': stats.get('appointments', 0),
+        'live_appointments': stats.get('live_appointments', 0),
+        'upcoming_appointments': sum(v for k, v in stats.items() if k.startswith('booked:')),
+    }
+
+
+def conditional_response(*tables, cache_control='private, no-cache'):
+    """Answer If-None-Match / If-Modified-Since from the table versions before the view runs."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            versions = read_table_versions(tables)
+            # the view's version-keyed caches read these same versions, so the body always matches the ETag
+            g.setdefault('table_versions', {}).update({name: versions.get(name, (0,))[0] for name in tables})
+            # the query string is part of the key because pages and filters give different bodies
+            etag = '-'.join(str(versions.get(name, (0,))[0]) for name in tables) + \
+                f"-{zlib.crc32(request.full_path.encode()):08x}"
+            updated_at = max((updated_at for _, updated_at in versions.values()), default=None)
+            last_modified = None
+            if updated_at:
+                # HTTP dates have whole seconds: send the end of the second of the last write, and only
+                # once that second is over, so any later write is at or after the date the client holds
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+                end_of_second = updated_at.replace(microsecond=0) + timedelta(seconds=1)
+                if end_of_second <= datetime.now(timezone.utc):
+                    last_modified = end_of_second
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(updated_at and since and updated_at < since)
+
+            response = Response(status=304) if not_modified else make_response(func(*args, **kwargs))
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+def table_versions(tables):
+    """Current TableVersion of each table, read once per request."""
+    known = g.setdefault('table_versions', {})
+    missing = [name for name in tables if name not in known]
+    if missing:
+        known.update({name: 0 for name in missing})
+        known.update({name: version for name, (version, _) in read_table_versions(missing).items()})
+    return [known[name] for name in tables]
+
+
+@app.template_global()
+def cached_fragment(name, tables, vary=None, ttl=None, caller=None):
+    """Render the enclosed template block once per version of `tables`.
+
+        {% call cached_fragment('doctor-rows', ['doctor', 'department'], vary=request.full_path) %}...{% endcall %}
+
+    Every committed write bumps its table's version, so the key changes and old entries just age out.
+    `vary` is anything else the block's output depends on, such as the query string or the rows shown.
+    """
+    if not app.config['FRAGMENT_CACHE']:
+        return caller()
+    digest = hashlib.sha1(repr(vary).encode()).hexdigest()[:16]
+    key = f"fragment:{name}:{'-'.join(map(str, table_versions(tables)))}:{digest}"
+    html = cache.get(key)
+    if html is None:
+        html = str(caller())
+        cache.set(key, html, ttl or app.config['FRAGMENT_CACHE_TTL'])
+    return Markup(html)
+
+
+def read_only(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
 def login_required(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -121,12 +1421,23 @@ def admin_required(func):
     return wrapper
 
 
+def profile_id(model):
+    # login stores the id; sessions created before that still need one lookup
+    if 'profile_id' not in session:
+        session['profile_id'] = db.session.query(model.id).filter_by(user_id=session['user_id']).scalar()
+    return session['profile_id']
+
+
 def doctor_required(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         if session.get('role') != 'doctor':
             flash("Doctor access only.", "danger")
             return redirect(url_for('index'))
+        g.doctor_id = profile_id(Doctor)
+        if g.doctor_id is None:
+            flash("Doctor profile not found.", "danger")
+            return redirect(url_for('index'))
         return func(*args, **kwargs)
 
     return wrapper
@@ -138,11 +1449,27 @@ def patient_required(func):
         if session.get('role') != 'patient':
             flash("Patient access only.", "danger")
             return redirect(url_for('index'))
+        g.patient_id = profile_id(Patient)
+        if g.patient_id is None:
+            flash("Patient profile not found.", "danger")
+            return redirect(url_for('index'))
         return func(*args, **kwargs)
 
     return wrapper
 
 
+def current_doctor():
+    if 'doctor' not in g:
+        g.doctor = db.session.get(Doctor, g.doctor_id, options=[joinedload(Doctor.department)])
+    return g.doctor
+
+
+def current_patient():
+    if 'patient' not in g:
+        g.patient = db.session.get(Patient, g.patient_id)
+    return g.patient
+
+
 
 
 @app.route('/')
@@ -157,10 +1484,17 @@ def login():
         pwd = request.form.get('password')
 
         user = User.query.filter_by(username=uname).first()
-        if user and check_password_hash(user.password, pwd):
+        if user and hasher.verify(user.password, pwd):
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.hash(pwd)
+                db.session.commit()
             session['user_id'] = user.id
             session['username'] = user.username
             session['role'] = user.role
+            if user.role == 'doctor':
+                session['profile_id'] = db.session.query(Doctor.id).filter_by(user_id=user.id).scalar()
+            elif user.role == 'patient':
+                session['profile_id'] = db.session.query(Patient.id).filter_by(user_id=user.id).scalar()
             flash(f"Welcome back, {user.username}!", "success")
 
 
@@ -193,7 +1527,7 @@ def register():
             return redirect(url_for('register'))
 
 
-        hashed = generate_password_hash(pwd)
+        hashed = hasher.hash(pwd)
         new_user = User(username=uname, email=mail, password=hashed, role='patient')
         db.session.add(new_user)
         db.session.flush()
@@ -226,37 +1560,42 @@ def logout():
 @login_required
 @admin_required
 def admin_dashboard():
-    total_doctors = Doctor.query.filter_by(is_active=True).count()
-    total_patients = Patient.query.filter_by(is_active=True).count()
-    total_appointments = Appointment.query.count()
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.appointment_date >= datetime.now().date(),
-        Appointment.status == 'Booked'
-    ).count()
-    
-    recent_appointments = Appointment.query.order_by(Appointment.created_at.desc()).limit(5).all()
+    recent_appointments = appointment_query('patient', 'doctor').order_by(Appointment.created_at.desc()).limit(5).all()
     
     return render_template('admin/dashboard.html',
-                         total_doctors=total_doctors,
-                         total_patients=total_patients,
-                         total_appointments=total_appointments,
-                         upcoming_appointments=upcoming_appointments,
-                         recent_appointments=recent_appointments)
+                         recent_appointments=recent_appointments,
+                         **read_dashboard_stats())
+
+@app.route('/admin/dashboard/refresh', methods=['POST'])
+@login_required
+@admin_required
+def admin_refresh_stats():
+    if app.config['BACKGROUND_JOBS']:
+        enqueue('recompute_stats')
+        db.session.commit()
+        flash('Counters will be recomputed by the background worker.', 'info')
+    else:
+        recompute_dashboard_stats()
+        flash('Counters recomputed.', 'success')
+    return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/doctors')
 @login_required
 @admin_required
+@read_only
 def admin_doctors():
     search = request.args.get('search', '')
+    query = Doctor.query.options(joinedload(Doctor.department))
     if search:
-        doctors = Doctor.query.filter(
-            (Doctor.full_name.contains(search)) |
-            (Doctor.department.has(Department.name.contains(search)))
-        ).all()
-    else:
-        doctors = Doctor.query.all()
+        query = search_doctors(query, search)
+
+    listing = paginate(query, {
+        'id': Doctor.id,
+        'name': Doctor.full_name,
+        'experience': Doctor.experience_years,
+    }, 'id')
     
-    return render_template('admin/doctors.html', doctors=doctors, search=search)
+    return render_template('admin/doctors.html', doctors=listing.items, listing=listing, search=search)
 
 @app.route('/admin/doctor/add', methods=['GET', 'POST'])
 @login_required
@@ -276,7 +1615,7 @@ def admin_add_doctor():
             flash('Username already exists', 'danger')
             return redirect(url_for('admin_add_doctor'))
         
-        hashed_password = generate_password_hash(password)
+        hashed_password = hasher.hash(password)
         new_user = User(username=username, email=email, password=hashed_password, role='doctor')
         db.session.add(new_user)
         db.session.flush()
@@ -295,7 +1634,7 @@ def admin_add_doctor():
         flash('Doctor added successfully!', 'success')
         return redirect(url_for('admin_doctors'))
     
-    departments = Department.query.all()
+    departments = cached_departments()
     return render_template('admin/add_doctor.html', departments=departments)
 
 @app.route('/admin/doctor/edit/<int:id>', methods=['GET', 'POST'])
@@ -315,7 +1654,7 @@ def admin_edit_doctor(id):
         flash('Doctor updated successfully!', 'success')
         return redirect(url_for('admin_doctors'))
     
-    departments = Department.query.all()
+    departments = cached_departments()
     return render_template('admin/edit_doctor.html', doctor=doctor, departments=departments)
 
 @app.route('/admin/doctor/delete/<int:id>')
@@ -331,17 +1670,20 @@ def admin_delete_doctor(id):
 @app.route('/admin/patients')
 @login_required
 @admin_required
+@read_only
 def admin_patients():
     search = request.args.get('search', '')
+    query = Patient.query
     if search:
-        patients = Patient.query.filter(
-            (Patient.full_name.contains(search)) |
-            (Patient.phone.contains(search))
-        ).all()
-    else:
-        patients = Patient.query.all()
+        query = search_patients(query, search)
+
+    listing = paginate(query, {
+        'id': Patient.id,
+        'name': Patient.full_name,
+        'age': Patient.age,
+    }, 'id')
     
-    return render_template('admin/patients.html', patients=patients, search=search)
+    return render_template('admin/patients.html', patients=listing.items, listing=listing, search=search)
 
 @app.route('/admin/patient/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -366,50 +1708,49 @@ def admin_edit_patient(id):
 @app.route('/admin/appointments')
 @login_required
 @admin_required
+@read_only
 def admin_appointments():
-    appointments = Appointment.query.order_by(Appointment.appointment_date.desc()).all()
-    return render_template('admin/appointments.html', appointments=appointments)
+    # the dashboard counter already knows the total, so no COUNT(*) over the table; the
+    # all-time total includes archived rows, which this listing cannot page to
+    listing = paginate_appointments(appointment_query('patient', 'doctor'),
+                                    total=read_dashboard_stats()['live_appointments'])
+    return render_template('admin/appointments.html', appointments=listing.items, listing=listing)
 
 @app.route('/admin/patient/<int:patient_id>/history')
+@login_required
+@admin_required
+@read_only
 def admin_patient_history(patient_id):
     patient = Patient.query.get(patient_id)
     if not patient:
         abort(404)
 
-    treatments = (
-        Treatment.query
-        .join(Appointment, Treatment.appointment_id == Appointment.id)
-        .join(Doctor, Appointment.doctor_id == Doctor.id)
-        .join(Department, Doctor.specialization_id == Department.id)
-        .filter(Appointment.patient_id == patient_id)
-        .order_by(Appointment.appointment_date.desc(),
-                  Appointment.appointment_time.desc())
-        .all()
-    )
-
+    listing = paginate_history(patient_id)
     return render_template('admin/patient_history.html',
                            patient=patient,
-                           treatments=treatments)
+                           history=listing.items,
+                           listing=listing)
 
 
 @app.route('/doctor/dashboard')
 @login_required
 @doctor_required
+@read_only
 def doctor_dashboard():
-    doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
+    doctor = current_doctor()
     
     today = datetime.now().date()
     week_end = today + timedelta(days=7)
     
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.doctor_id == doctor.id,
+    upcoming_appointments = appointment_query('patient').filter(
+        Appointment.doctor_id == g.doctor_id,
         Appointment.appointment_date >= today,
         Appointment.appointment_date <= week_end,
         Appointment.status == 'Booked'
     ).order_by(Appointment.appointment_date).all()
     
     patients = db.session.query(Patient).join(Appointment).filter(
-        Appointment.doctor_id == doctor.id
+        Appointment.doctor_id == g.doctor_id
     ).distinct().all()
     
     return render_template('doctor/dashboard.html',
@@ -420,9 +1761,9 @@ def doctor_dashboard():
 @app.route('/doctor/appointments')
 @login_required
 @doctor_required
+@read_only
 def doctor_appointments():
-    doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
-    appointments = Appointment.query.filter_by(doctor_id=doctor.id).order_by(Appointment.appointment_date.desc()).all()
+    appointments = appointment_query('patient').filter_by(doctor_id=g.doctor_id).order_by(Appointment.appointment_date.desc()).all()
     return render_template('doctor/appointments.html', appointments=appointments)
 
 @app.route('/doctor/appointment/complete/<int:id>', methods=['GET', 'POST'])
@@ -445,6 +1786,8 @@ def doctor_complete_appointment(id):
             notes=notes
         )
         db.session.add(treatment)
+        db.session.flush()
+        refresh_history(Appointment.id == appointment.id)
         db.session.commit()
         
         flash('Appointment marked as completed!', 'success')
@@ -455,21 +1798,47 @@ def doctor_complete_appointment(id):
 @app.route('/doctor/patient/history/<int:id>')
 @login_required
 @doctor_required
+@read_only
 def doctor_patient_history(id):
     patient = Patient.query.get_or_404(id)
-    appointments = Appointment.query.filter_by(
-        patient_id=patient.id,
-        status='Completed'
-    ).order_by(Appointment.appointment_date.desc()).all()
+    listing = paginate_history(patient.id)
     
-    return render_template('doctor/patient_history.html', patient=patient, appointments=appointments)
+    return render_template('doctor/patient_history.html', patient=patient, history=listing.items, listing=listing)
 
 @app.route('/doctor/availability', methods=['GET', 'POST'])
 @login_required
 @doctor_required
 def doctor_availability():
-    doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
     
+    if request.method == 'POST' and request.form.get('kind') == 'rule':
+        weekdays = sum(1 << int(day) for day in set(request.form.getlist('weekdays')) & WEEKDAY_VALUES)
+        try:
+            start_time = datetime.strptime(request.form.get('start_time'), '%H:%M').time()
+            end_time = datetime.strptime(request.form.get('end_time'), '%H:%M').time()
+            valid_from = datetime.strptime(request.form.get('valid_from'), '%Y-%m-%d').date()
+            valid_until = request.form.get('valid_until')
+            valid_until = datetime.strptime(valid_until, '%Y-%m-%d').date() if valid_until else None
+        except (TypeError, ValueError):
+            flash('Enter start and end times as HH:MM and dates as YYYY-MM-DD.', 'danger')
+            return redirect(url_for('doctor_availability'))
+
+        if not weekdays or end_time <= start_time or (valid_until and valid_until < valid_from):
+            flash('Pick at least one weekday, an end time after the start and a valid date range.', 'danger')
+            return redirect(url_for('doctor_availability'))
+
+        db.session.add(AvailabilityRule(
+            doctor_id=g.doctor_id,
+            weekdays=weekdays,
+            start_time=start_time,
+            end_time=end_time,
+            valid_from=valid_from,
+            valid_until=valid_until
+        ))
+        db.session.commit()
+
+        flash('Weekly availability added!', 'success')
+        return redirect(url_for('doctor_availability'))
+
     if request.method == 'POST':
         date_str = request.form.get('date')
         start_time_str = request.form.get('start_time')
@@ -480,7 +1849,7 @@ def doctor_availability():
         end_time = datetime.strptime(end_time_str, '%H:%M').time()
         
         availability = DoctorAvailability(
-            doctor_id=doctor.id,
+            doctor_id=g.doctor_id,
             date=date,
             start_time=start_time,
             end_time=end_time
@@ -495,25 +1864,60 @@ def doctor_availability():
     week_end = today + timedelta(days=7)
     
     availability_list = DoctorAvailability.query.filter(
-        DoctorAvailability.doctor_id == doctor.id,
+        DoctorAvailability.doctor_id == g.doctor_id,
         DoctorAvailability.date >= today,
         DoctorAvailability.date <= week_end
     ).order_by(DoctorAvailability.date).all()
+
+    rules = AvailabilityRule.query.options(selectinload(AvailabilityRule.exceptions)).filter(
+        AvailabilityRule.doctor_id == g.doctor_id,
+        or_(AvailabilityRule.valid_until.is_(None), AvailabilityRule.valid_until >= today)
+    ).order_by(AvailabilityRule.valid_from).all()
     
-    return render_template('doctor/availability.html', availability_list=availability_list)
+    return render_template('doctor/availability.html', availability_list=availability_list, rules=rules,
+                           weekdays=WEEKDAYS, today=today)
+
+
+@app.route('/doctor/availability/rule/<int:id>/skip', methods=['POST'])
+@login_required
+@doctor_required
+def doctor_skip_availability(id):
+    rule = AvailabilityRule.query.filter_by(id=id, doctor_id=g.doctor_id).first_or_404()
+    try:
+        day = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        flash('Pick a date to remove from the weekly schedule.', 'danger')
+        return redirect(url_for('doctor_availability'))
+    if not AvailabilityException.query.filter_by(rule_id=rule.id, date=day).first():
+        db.session.add(AvailabilityException(rule_id=rule.id, date=day))
+        db.session.commit()
+    flash(f'{day} removed from the weekly schedule.', 'info')
+    return redirect(url_for('doctor_availability'))
+
+
+@app.route('/doctor/availability/rule/<int:id>/delete', methods=['POST'])
+@login_required
+@doctor_required
+def doctor_delete_availability_rule(id):
+    rule = AvailabilityRule.query.filter_by(id=id, doctor_id=g.doctor_id).first_or_404()
+    db.session.delete(rule)
+    db.session.commit()
+    flash('Weekly availability removed.', 'info')
+    return redirect(url_for('doctor_availability'))
 
 
 
 @app.route('/patient/dashboard')
 @login_required
 @patient_required
+@read_only
 def patient_dashboard():
-    patient = Patient.query.filter_by(user_id=session['user_id']).first()
-    departments = Department.query.all()
+    patient = current_patient()
+    departments = cached_departments()
     
     today = datetime.now().date()
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.patient_id == patient.id,
+    upcoming_appointments = appointment_query('department').filter(
+        Appointment.patient_id == g.patient_id,
         Appointment.appointment_date >= today,
         Appointment.status == 'Booked'
     ).order_by(Appointment.appointment_date).all()
@@ -526,92 +1930,101 @@ def patient_dashboard():
 @app.route('/patient/doctors')
 @login_required
 @patient_required
+@read_only
 def patient_doctors():
     dept_id = request.args.get('department')
     search = request.args.get('search', '')
     
-    query = Doctor.query.filter_by(is_active=True)
+    query = Doctor.query.options(joinedload(Doctor.department)).filter_by(is_active=True)
     
     if dept_id:
         query = query.filter_by(specialization_id=dept_id)
     
     if search:
-        query = query.filter(Doctor.full_name.contains(search))
+        query = search_doctors(query, search)
     
     doctors = query.all()
-    departments = Department.query.all()
+    departments = cached_departments()
+
+    today = datetime.now().date()
+    slots = free_slots([d.id for d in doctors], today, today + timedelta(days=BOOKING_WINDOW_DAYS))
+    next_slots = {doctor_id: doctor_slots[0] for doctor_id, doctor_slots in slots.items() if doctor_slots}
     
     return render_template('patient/doctors.html',
                          doctors=doctors,
                          departments=departments,
+                         next_slots=next_slots,
                          selected_dept=dept_id,
                          search=search)
 
 @app.route('/patient/doctor/<int:id>')
 @login_required
 @patient_required
+@read_only
 def patient_doctor_detail(id):
     doctor = Doctor.query.get_or_404(id)
     
     today = datetime.now().date()
-    week_end = today + timedelta(days=7)
-    
-    availability = DoctorAvailability.query.filter(
-        DoctorAvailability.doctor_id == doctor.id,
-        DoctorAvailability.date >= today,
-        DoctorAvailability.date <= week_end,
-        DoctorAvailability.is_available == True
-    ).order_by(DoctorAvailability.date).all()
+    slots = free_slots([doctor.id], today, today + timedelta(days=BOOKING_WINDOW_DAYS))[doctor.id]
+
+    slots_by_date = {}
+    for slot in slots:
+        slots_by_date.setdefault(slot.date(), []).append(slot)
     
-    return render_template('patient/doctor_detail.html', doctor=doctor, availability=availability)
+    return render_template('patient/doctor_detail.html', doctor=doctor, slots_by_date=slots_by_date)
 
 @app.route('/patient/book-appointment/<int:doctor_id>', methods=['GET', 'POST'])
 @login_required
 @patient_required
 def patient_book_appointment(doctor_id):
     doctor = Doctor.query.get_or_404(doctor_id)
-    patient = Patient.query.filter_by(user_id=session['user_id']).first()
     
+    today = datetime.now().date()
+    slots = free_slots([doctor_id], today, today + timedelta(days=BOOKING_WINDOW_DAYS))[doctor_id]
+
     if request.method == 'POST':
-        appointment_date_str = request.form.get('appointment_date')
-        appointment_time_str = request.form.get('appointment_time')
+        try:
+            slot = datetime.strptime(request.form.get('slot'), '%Y-%m-%d %H:%M')
+        except (TypeError, ValueError):
+            slot = None
         reason = request.form.get('reason')
-        
-        appointment_date = datetime.strptime(appointment_date_str, '%Y-%m-%d').date()
-        appointment_time = datetime.strptime(appointment_time_str, '%H:%M').time()
-        
-        # Check for conflicts
-        existing = Appointment.query.filter_by(
-            doctor_id=doctor_id,
-            appointment_date=appointment_date,
-            appointment_time=appointment_time
-        ).filter(Appointment.status != 'Cancelled').first()
-        
-        if existing:
-            flash('This time slot is already booked. Please choose another time.', 'danger')
+
+        if slot not in slots:
+            flash('This time slot is not available. Please choose another time.', 'danger')
             return redirect(url_for('patient_book_appointment', doctor_id=doctor_id))
+
+        appointment_date = slot.date()
+        appointment_time = slot.time()
         
         appointment = Appointment(
-            patient_id=patient.id,
+            patient_id=g.patient_id,
             doctor_id=doctor_id,
             appointment_date=appointment_date,
             appointment_time=appointment_time,
             reason=reason
         )
         db.session.add(appointment)
-        db.session.commit()
+        # uq_appointment_doctor_slot rejects a second live booking, so concurrent
+        # requests race safely on the insert instead of on a check-then-insert
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('This time slot is already booked. Please choose another time.', 'danger')
+            return redirect(url_for('patient_book_appointment', doctor_id=doctor_id))
         
         flash('Appointment booked successfully!', 'success')
         return redirect(url_for('patient_appointments'))
     
-    return render_template('patient/book_appointment.html', doctor=doctor)
+    return render_template('patient/book_appointment.html', doctor=doctor, slots=slots,
+                           selected_slot=request.args.get('slot'))
 
 @app.route('/patient/appointments')
 @login_required
 @patient_required
+@read_only
 def patient_appointments():
-    patient = Patient.query.filter_by(user_id=session['user_id']).first()
-    appointments = Appointment.query.filter_by(patient_id=patient.id).order_by(Appointment.appointment_date.desc()).all()
+    appointments = appointment_query('department').filter_by(patient_id=g.patient_id).order_by(Appointment.appointment_date.desc()).all()
     return render_template('patient/appointments.html', appointments=appointments)
 
 @app.route('/patient/appointment/cancel/<int:id>')
@@ -619,9 +2032,8 @@ def patient_appointments():
 @patient_required
 def patient_cancel_appointment(id):
     appointment = Appointment.query.get_or_404(id)
-    patient = Patient.query.filter_by(user_id=session['user_id']).first()
     
-    if appointment.patient_id != patient.id:
+    if appointment.patient_id != g.patient_id:
         flash('Access denied.', 'danger')
         return redirect(url_for('patient_appointments'))
     
@@ -634,20 +2046,17 @@ def patient_cancel_appointment(id):
 @app.route('/patient/history')
 @login_required
 @patient_required
+@read_only
 def patient_history():
-    patient = Patient.query.filter_by(user_id=session['user_id']).first()
-    appointments = Appointment.query.filter_by(
-        patient_id=patient.id,
-        status='Completed'
-    ).order_by(Appointment.appointment_date.desc()).all()
+    listing = paginate_history(g.patient_id)
     
-    return render_template('patient/history.html', appointments=appointments)
+    return render_template('patient/history.html', history=listing.items, listing=listing)
 
 @app.route('/patient/profile', methods=['GET', 'POST'])
 @login_required
 @patient_required
 def patient_profile():
-    patient = Patient.query.filter_by(user_id=session['user_id']).first()
+    patient = current_patient()
     
     if request.method == 'POST':
         patient.full_name = request.form.get('full_name')
@@ -665,49 +2074,269 @@ def patient_profile():
 
 
 
-@app.route('/api/appointments', methods=['GET'])
-@login_required
-def api_get_appointments():
-    appointments = Appointment.query.all()
-    return jsonify([{
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_STREAM_BATCH = 500
+API_BULK_MAX_ITEMS = 500
+BULK_ACTIONS = {'doctor': ('complete', 'cancel'), 'patient': ('cancel',), 'admin': ('cancel',)}
+
+
+def appointment_to_dict(a):
+    return {
         'id': a.id,
         'patient_name': a.patient.full_name,
         'doctor_name': a.doctor.full_name,
         'date': a.appointment_date.strftime('%Y-%m-%d'),
         'time': a.appointment_time.strftime('%H:%M'),
         'status': a.status
-    } for a in appointments])
+    }
 
-@app.route('/api/appointment/<int:id>', methods=['GET'])
+
+def appointment_rows(*extra):
+    """The API's appointment columns as plain row tuples from one joined SELECT; no entities, no Text columns."""
+    return select(
+        Appointment.id, Patient.full_name.label('patient_name'), Doctor.full_name.label('doctor_name'),
+        Appointment.appointment_date, Appointment.appointment_time, Appointment.status, *extra
+    ).join(Patient, Appointment.patient_id == Patient.id) \
+     .join(Doctor, Appointment.doctor_id == Doctor.id)
+
+
+def appointment_row_to_dict(row):
+    return {
+        'id': row.id,
+        'patient_name': row.patient_name,
+        'doctor_name': row.doctor_name,
+        'date': row.appointment_date.isoformat(),
+        'time': row.appointment_time.isoformat('minutes'),
+        'status': row.status
+    }
+
+
+@app.route('/api/appointments', methods=['GET'])
 @login_required
-def api_get_appointment(id):
-    appointment = Appointment.query.get_or_404(id)
+@read_only
+@conditional_response('appointment', 'patient', 'doctor')
+def api_get_appointments():
+    query = appointment_rows().order_by(Appointment.appointment_date, Appointment.id)
+
+    if request.args.get('stream') == 'ndjson':
+        def generate():
+            # yield_per keeps a server-side cursor open and only holds one batch in memory
+            rows = db.session.execute(query.execution_options(yield_per=API_STREAM_BATCH))
+            for batch in rows.partitions():
+                yield ''.join(app.json.dumps(appointment_row_to_dict(row)) + '\n' for row in batch)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        limit = min(max(int(request.args.get('limit', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            query = query.where(appointments_after(cursor))
+        except ValueError:
+            return jsonify({'error': 'invalid cursor'}), 400
+
+    appointments = db.session.execute(query.limit(limit + 1)).all()
+    next_cursor = None
+    if len(appointments) > limit:
+        appointments = appointments[:limit]
+        last = appointments[-1]
+        next_cursor = encode_cursor(last.appointment_date, last.id)
+
     return jsonify({
-        'id': appointment.id,
-        'patient_name': appointment.patient.full_name,
-        'doctor_name': appointment.doctor.full_name,
-        'date': appointment.appointment_date.strftime('%Y-%m-%d'),
-        'time': appointment.appointment_time.strftime('%H:%M'),
-        'status': appointment.status,
-        'reason': appointment.reason
+        'appointments': [appointment_row_to_dict(row) for row in appointments],
+        'next_cursor': next_cursor
     })
 
+def close_booked(condition, status):
+    """Move the Booked appointments matching condition to status in one UPDATE; returns {id: row} of the changed rows."""
+    result = db.session.execute(
+        update(Appointment)
+        .where(condition, Appointment.status == 'Booked')
+        .values(status=status)
+        .returning(Appointment.id, Appointment.doctor_id, Appointment.appointment_date)
+        .execution_options(synchronize_session=False))
+    closed = {row.id: row for row in result}
+    queue_appointment_events(db.session, [
+        (row.id, row.doctor_id, row.appointment_date, status) for row in closed.values()])
+    return closed
+
+
+def record_closed(closed, with_treatments=False):
+    # set-based UPDATE/INSERT skip the ORM flush hooks, so keep the derived rows in step here
+    conn = db.session.connection()
+    booked = Counter(booked_key(row.appointment_date) for row in closed.values())
+    add_dashboard_stats(conn, {key: -count for key, count in booked.items()})
+    bump_table_versions(conn, {'appointment', 'treatment'} if with_treatments else {'appointment'})
+
+
+@app.route('/api/appointments/bulk', methods=['POST'])
+@login_required
+def api_bulk_update_appointments():
+    """Complete or cancel many appointments in one transaction.
+
+    Body: {"items": [{"id": 1, "action": "complete", "diagnosis": ..., "prescription": ..., "notes": ...},
+                     {"id": 2, "action": "cancel"}]}
+    Doctors may complete or cancel their own appointments, patients cancel their own, admins cancel any.
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('items') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'expected a JSON object with a non-empty "items" list'}), 400
+    if len(items) > API_BULK_MAX_ITEMS:
+        return jsonify({'error': f'at most {API_BULK_MAX_ITEMS} items per request'}), 400
+
+    role = session.get('role')
+    owner_column = {'doctor': 'doctor_id', 'patient': 'patient_id'}.get(role)
+    owner = profile_id(Doctor if role == 'doctor' else Patient) if owner_column else None
+    ids = {item['id'] for item in items if isinstance(item, dict) and type(item.get('id')) is int}
+    current = {row.id: row for row in db.session.execute(
+        select(Appointment.id, Appointment.doctor_id, Appointment.patient_id, Appointment.status)
+        .where(Appointment.id.in_(ids)))}
+
+    results, planned, seen = [], {'complete': {}, 'cancel': {}}, set()
+    for item in items:
+        item_id = item.get('id') if isinstance(item, dict) else None
+        action = item.get('action') if isinstance(item, dict) else None
+        row = current.get(item_id) if type(item_id) is int else None
+        if type(item_id) is not int:
+            error = 'id must be an integer'
+        elif item_id in seen:
+            error = 'duplicate id'
+        elif action not in BULK_ACTIONS.get(role, ()):
+            error = f'action must be one of {", ".join(BULK_ACTIONS.get(role, ()))}'
+        elif row is None:
+            error = 'not found'
+        elif owner_column and getattr(row, owner_column) != owner:
+            error = 'access denied'
+        elif row.status != 'Booked':
+            error = f'appointment is {row.status}'
+        else:
+            error = None
+            planned[action][item_id] = item
+            seen.add(item_id)
+        results.append({'id': item_id, 'ok': error is None, **({'error': error} if error else {})})
+
+    completed = close_booked(Appointment.id.in_(planned['complete']), 'Completed') if planned['complete'] else {}
+    cancelled = close_booked(Appointment.id.in_(planned['cancel']), 'Cancelled') if planned['cancel'] else {}
+    now = datetime.now()
+    if completed:
+        db.session.execute(insert(Treatment), [{
+            'appointment_id': appointment_id,
+            'diagnosis': planned['complete'][appointment_id].get('diagnosis'),
+            'prescription': planned['complete'][appointment_id].get('prescription'),
+            'notes': planned['complete'][appointment_id].get('notes'),
+            'created_at': now,
+        } for appointment_id in completed])
+    if completed:
+        refresh_history(Appointment.id.in_(completed))
+    if completed or cancelled:
+        record_closed({**completed, **cancelled}, with_treatments=bool(completed))
+    db.session.commit()
+
+    changed = completed.keys() | cancelled.keys()
+    for result in results:
+        # another request may have closed the appointment between the SELECT and the UPDATE
+        if result['ok'] and result['id'] not in changed:
+            result.update(ok=False, error='appointment is no longer Booked')
+    return jsonify({'results': results, 'completed': len(completed), 'cancelled': len(cancelled)})
+
+
+@app.route('/api/appointments/cancel-day', methods=['POST'])
+@login_required
+def api_cancel_doctor_day():
+    """Cancel every Booked appointment of one doctor on one date: {"doctor_id": 3, "date": "2025-01-31"}."""
+    payload = request.get_json(silent=True) or {}
+    role = session.get('role')
+    if role == 'doctor':
+        doctor_id = profile_id(Doctor)
+    elif role == 'admin':
+        doctor_id = payload.get('doctor_id')
+    else:
+        return jsonify({'error': 'doctors and admins only'}), 403
+    try:
+        day = datetime.strptime(str(payload.get('date')), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+    if type(doctor_id) is not int:
+        return jsonify({'error': 'doctor_id must be an integer'}), 400
+
+    cancelled = close_booked(and_(Appointment.doctor_id == doctor_id, Appointment.appointment_date == day), 'Cancelled')
+    if cancelled:
+        record_closed(cancelled)
+    db.session.commit()
+    return jsonify({'doctor_id': doctor_id, 'date': day.isoformat(), 'cancelled': sorted(cancelled)})
+
+
+@app.route('/api/appointments/events')
+@login_required
+def api_appointment_events():
+    """Server-sent events for bookings, cancellations, completions and no-shows as they commit.
+
+    Doctors get their own appointments; admins everything, or ?doctor_id= / ?department_id=.
+    Each stream blocks its worker until the client leaves, hence off unless LIVE_UPDATES is set.
+    """
+    if not app.config['LIVE_UPDATES']:
+        abort(404)
+    role = session.get('role')
+    if role == 'doctor':
+        doctor_id, department_id = profile_id(Doctor), None
+    elif role == 'admin':
+        doctor_id = request.args.get('doctor_id', type=int)
+        department_id = request.args.get('department_id', type=int)
+    else:
+        return jsonify({'error': 'doctors and admins only'}), 403
+    # an idle stream must not hold a pooled connection for its whole lifetime
+    db.session.close()
+    subscription = feed.subscribe(doctor_id, department_id)
+    keepalive = app.config['FEED_KEEPALIVE_SECONDS']
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    e = subscription[0].get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {e['type']}\ndata: {app.json.dumps(e)}\n\n"
+        finally:
+            feed.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/appointment/<int:id>', methods=['GET'])
+@login_required
+@read_only
+@conditional_response('appointment', 'patient', 'doctor')
+def api_get_appointment(id):
+    row = db.session.execute(appointment_rows(Appointment.reason).where(Appointment.id == id)).first()
+    if row is None:
+        abort(404)
+    return jsonify({**appointment_row_to_dict(row), 'reason': row.reason})
+
 @app.route('/api/doctors', methods=['GET'])
+@read_only
+@conditional_response('doctor', 'department', cache_control='public, max-age=60')
 def api_get_doctors():
-    doctors = Doctor.query.filter_by(is_active=True).all()
-    return jsonify([{
-        'id': d.id,
-        'name': d.full_name,
-        'specialization': d.department.name,
-        'phone': d.phone,
-        'experience': d.experience_years
-    } for d in doctors])
+    return jsonify(cached_doctor_directory())
 
 @app.route('/api/patients', methods=['GET'])
 @login_required
 @admin_required
+@read_only
+@conditional_response('patient')
 def api_get_patients():
-    patients = Patient.query.filter_by(is_active=True).all()
+    patients = db.session.execute(
+        select(Patient.id, Patient.full_name, Patient.age, Patient.phone, Patient.blood_group)
+        .where(Patient.is_active == True)
+        .order_by(Patient.id))
     return jsonify([{
         'id': p.id,
         'name': p.full_name,
@@ -716,9 +2345,1527 @@ def api_get_patients():
         'blood_group': p.blood_group
     } for p in patients])
 
+TASKS = {}
+# job name -> seconds between runs
+PERIODIC_JOBS = {
+    'mark_no_shows': 3600,
+    'purge_availability': 24 * 3600,
+    'archive_appointments': 24 * 3600,
+}
+
+
+def task(name, max_attempts=5):
+    def register(func):
+        TASKS[name] = (func, max_attempts)
+        return func
+    return register
+
+
+def enqueue(name, delay=0, **payload):
+    """Queue TASKS[name](**payload) in the current transaction; it runs after the caller commits."""
+    job = Job(name=name, payload=json.dumps(payload), max_attempts=TASKS[name][1],
+              run_at=datetime.now() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+
+def claim_job(worker):
+    """Lock the next due job for this worker, or return None when nothing is due."""
+    now = datetime.now()
+    stale = now - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT_SECONDS'])
+    due = or_(and_(Job.status == 'queued', Job.run_at <= now),
+              and_(Job.status == 'running', Job.locked_at < stale))
+    while True:
+        job_id = db.session.execute(
+            select(Job.id).where(due).order_by(Job.run_at).limit(1).with_for_update(skip_locked=True)).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        # the conditional UPDATE is the lock on SQLite, where FOR UPDATE SKIP LOCKED is not available
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, due)
+            .values(status='running', locked_by=worker, locked_at=now, attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+
+
+def run_job(job):
+    func, _ = TASKS[job.name]
+    try:
+        func(**json.loads(job.payload))
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = f"{type(e).__name__}: {e}"
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.now()
+            app.logger.error("job %s %s failed for good: %s", job.id, job.name, job.last_error)
+        else:
+            backoff = min(app.config['JOB_BACKOFF_SECONDS'] * 2 ** (job.attempts - 1),
+                          app.config['JOB_MAX_BACKOFF_SECONDS'])
+            job.status = 'queued'
+            job.run_at = datetime.now() + timedelta(seconds=backoff)
+            app.logger.warning("job %s %s failed (attempt %s), retrying in %ss: %s",
+                               job.id, job.name, job.attempts, backoff, job.last_error)
+    else:
+        job.status = 'done'
+        job.finished_at = datetime.now()
+    job.locked_by = job.locked_at = None
+    db.session.commit()
+
+
+def schedule_periodic_jobs():
+    now = datetime.now()
+    known = set(db.session.execute(select(JobSchedule.name)).scalars())
+    db.session.add_all(JobSchedule(name=name, next_run_at=now) for name in PERIODIC_JOBS if name not in known)
+    try:
+        db.session.flush()
+    except IntegrityError:  # another worker created them first
+        db.session.rollback()
+        return
+    for name, interval in PERIODIC_JOBS.items():
+        advanced = db.session.execute(
+            update(JobSchedule).where(JobSchedule.name == name, JobSchedule.next_run_at <= now)
+            .values(next_run_at=now + timedelta(seconds=interval))
+            .execution_options(synchronize_session=False)).rowcount
+        if advanced:
+            enqueue(name)
+    db.session.commit()
+
+
+@task('recompute_stats')
+def recompute_stats_job():
+    recompute_dashboard_stats()
+
+
+@task('rebuild_history')
+def rebuild_history_job(patient_id=None):
+    rebuild_patient_history(patient_id)
+
+
+@task('mark_no_shows')
+def mark_no_shows():
+    """Booked appointments whose day has passed become No-show."""
+    closed = close_booked(Appointment.appointment_date < datetime.now().date(), 'No-show')
+    if closed:
+        record_closed(closed)
+    db.session.commit()
+
+
+@task('purge_availability')
+def purge_availability(days=None):
+    """Archive one-off availability and delete rule exceptions and ended rules older than the retention window."""
+    cutoff = datetime.now().date() - timedelta(days=days or app.config['AVAILABILITY_RETENTION_DAYS'])
+    ended_rules = select(AvailabilityRule.id).where(AvailabilityRule.valid_until < cutoff)
+    db.session.execute(delete(AvailabilityException).where(
+        or_(AvailabilityException.date < cutoff, AvailabilityException.rule_id.in_(ended_rules))))
+    db.session.execute(delete(AvailabilityRule).where(AvailabilityRule.valid_until < cutoff))
+    db.session.commit()
+    archive_availability(cutoff, app.config['ARCHIVE_BATCH_SIZE'])
+
+
+@task('archive_appointments')
+def archive_appointments_job(days=None):
+    archive_appointments(datetime.now().date() - timedelta(days=days or app.config['ARCHIVE_HORIZON_DAYS']),
+                         app.config['ARCHIVE_BATCH_SIZE'])
+
+
+ARCHIVED_STATUSES = ('Completed', 'Cancelled', 'No-show')
+ARCHIVED_TABLES = ((Appointment, ArchivedAppointment), (Treatment, ArchivedTreatment),
+                   (DoctorAvailability, ArchivedAvailability))
+
+
+def check_archive_ids(*models):
+    """Refuse to archive while a live id is also an archived one; the copy would collide or mix two records."""
+    for live, archive in ARCHIVED_TABLES:
+        if live not in models:
+            continue
+        overlap = db.session.execute(
+            select(db.func.count()).select_from(live).join(archive, archive.id == live.id)).scalar()
+        if overlap:
+            raise RuntimeError(f"{overlap} {live.__tablename__} ids are also in {archive.__tablename__}; "
+                               f"ids were reused, run the migrations and resolve the duplicates first")
+
+
+def archive_appointments(cutoff, batch_size):
+    """Move closed appointments dated before cutoff, with their treatments, in committed batches.
+
+    Each batch is one transaction and the next batch re-selects from what is still live,
+    so an interrupted run is resumed by running it again. Returns the number moved.
+    """
+    check_archive_ids(Appointment, Treatment)
+    moved = 0
+    while True:
+        ids = list(db.session.execute(
+            select(Appointment.id).where(Appointment.appointment_date < cutoff,
+                                         Appointment.status.in_(ARCHIVED_STATUSES))
+            .order_by(Appointment.id).limit(batch_size)).scalars())
+        if not ids:
+            return moved
+        now = datetime.now()
+        db.session.execute(insert(ArchivedAppointment).from_select(
+            ['id', 'patient_id', 'doctor_id', 'appointment_date', 'appointment_time', 'status', 'reason',
+             'created_at', 'archived_at'],
+            select(Appointment.id, Appointment.patient_id, Appointment.doctor_id, Appointment.appointment_date,
+                   Appointment.appointment_time, Appointment.status, Appointment.reason, Appointment.created_at,
+                   db.literal(now)).where(Appointment.id.in_(ids))))
+        db.session.execute(insert(ArchivedTreatment).from_select(
+            ['id', 'appointment_id', 'diagnosis', 'prescription', 'notes', 'created_at'],
+            select(Treatment.id, Treatment.appointment_id, Treatment.diagnosis, Treatment.prescription,
+                   Treatment.notes, Treatment.created_at).where(Treatment.appointment_id.in_(ids))))
+        db.session.execute(delete(Treatment).where(Treatment.appointment_id.in_(ids)))
+        db.session.execute(delete(Appointment).where(Appointment.id.in_(ids)))
+        # closed rows never count as booked, and the all-time total includes the archive
+        add_dashboard_stats(db.session.connection(), {'live_appointments': -len(ids)})
+        bump_table_versions(db.session.connection(), {'appointment', 'treatment'})
+        db.session.commit()
+        moved += len(ids)
+
+
+def archive_availability(cutoff, batch_size):
+    check_archive_ids(DoctorAvailability)
+    moved = 0
+    while True:
+        ids = list(db.session.execute(
+            select(DoctorAvailability.id).where(DoctorAvailability.date < cutoff)
+            .order_by(DoctorAvailability.id).limit(batch_size)).scalars())
+        if not ids:
+            return moved
+        db.session.execute(insert(ArchivedAvailability).from_select(
+            ['id', 'doctor_id', 'date', 'start_time', 'end_time', 'is_available', 'archived_at'],
+            select(DoctorAvailability.id, DoctorAvailability.doctor_id, DoctorAvailability.date,
+                   DoctorAvailability.start_time, DoctorAvailability.end_time, DoctorAvailability.is_available,
+                   db.literal(datetime.now())).where(DoctorAvailability.id.in_(ids))))
+        db.session.execute(delete(DoctorAvailability).where(DoctorAvailability.id.in_(ids)))
+        bump_table_versions(db.session.connection(), {'doctor_availability'})
+        db.session.commit()
+        moved += len(ids)
+
+
+@app.cli.command('archive')
+@click.option('--days', default=None, type=int, help='Horizon in days; defaults to ARCHIVE_HORIZON_DAYS.')
+@click.option('--batch-size', default=None, type=int, help='Rows moved per transaction.')
+def archive_command(days, batch_size):
+    cutoff = datetime.now().date() - timedelta(days=days or app.config['ARCHIVE_HORIZON_DAYS'])
+    batch_size = batch_size or app.config['ARCHIVE_BATCH_SIZE']
+    started = time.perf_counter()
+    try:
+        appointments = archive_appointments(cutoff, batch_size)
+        availability = archive_availability(cutoff, batch_size)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    print(f"Archived {appointments} appointments and {availability} availability windows dated before "
+          f"{cutoff} in {time.perf_counter() - started:.1f}s.")
+
+
+@app.cli.command('worker')
+@click.option('--concurrency', default=2, help='Jobs run in parallel, one thread each.')
+@click.option('--poll', default=1.0, help='Seconds to wait when no job is due.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+@click.option('--scheduler/--no-scheduler', default=True, help='Also enqueue the periodic jobs when due.')
+def worker(concurrency, poll, burst, scheduler):
+    name = f"{os.uname().nodename}:{os.getpid()}"
+    stop = threading.Event()
+
+    def loop(n):
+        scheduled = 0
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    if scheduler and n == 0 and time.monotonic() - scheduled >= poll:
+                        schedule_periodic_jobs()
+                        scheduled = time.monotonic()
+                    job = claim_job(f"{name}:{n}")
+                    if job is None:
+                        if burst:
+                            return
+                        stop.wait(poll)
+                        continue
+                    started = time.perf_counter()
+                    run_job(job)
+                    click.echo(f"job {job.id} {job.name} {job.status} in {time.perf_counter() - started:.2f}s", err=True)
+                except Exception:
+                    # e.g. "database is locked": keep polling; a job left running is reclaimed after
+                    # JOB_LOCK_TIMEOUT_SECONDS
+                    app.logger.exception("worker %s:%s failed; polling again", name, n)
+                    stop.wait(poll)
+                finally:
+                    db.session.remove()
+
+    threads = [threading.Thread(target=loop, args=(n,), daemon=True) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+@app.cli.command('enqueue')
+@click.argument('name', type=click.Choice(sorted(TASKS)))
+@click.option('--payload', default='{}', help='Keyword arguments as a JSON object.')
+@click.option('--delay', default=0, help='Seconds before the job becomes due.')
+def enqueue_command(name, payload, delay):
+    job = enqueue(name, delay, **json.loads(payload))
+    db.session.commit()
+    print(f"Queued job {job.id} {name}.")
+
+
+@app.cli.command('jobs')
+def list_jobs():
+    for status, count in db.session.query(Job.status, db.func.count()).group_by(Job.status).order_by(Job.status):
+        print(f"{status:8} {count}")
+    for job in Job.query.filter_by(status='failed').order_by(Job.finished_at.desc()).limit(10):
+        print(f"failed job {job.id} {job.name} after {job.attempts} attempts: {job.last_error}")
+
+
+# Ordered schema changes for databases created before the models declared them.
+# create_all() already builds everything for a fresh file, so each step must be idempotent.
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        return func
+    return register
+
+
+def create_index(table, name):
+    index = next(i for i in table.__table__.indexes if i.name == name)
+    index.create(db.engine, checkfirst=True)
+
+
+@migration(1, 'hot filter column indexes')
+def create_filter_indexes():
+    create_index(Patient, 'ix_patient_user_id')
+    create_index(Doctor, 'ix_doctor_user_id')
+    create_index(Treatment, 'ix_treatment_appointment_id')
+    create_index(DoctorAvailability, 'ix_availability_doctor_date')
+    for name in ('ix_appointment_doctor_date_status', 'ix_appointment_patient_status_date',
+                 'ix_appointment_date', 'ix_appointment_created_at'):
+        create_index(Appointment, name)
+
+
+@migration(2, 'unique live booking per doctor slot')
+def create_slot_unique_index():
+    duplicates = db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time
+    ).filter(Appointment.status != 'Cancelled').group_by(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time
+    ).having(db.func.count() > 1).all()
+    if duplicates:
+        raise SystemExit(f"Cannot add uq_appointment_doctor_slot, double-booked slots: {duplicates}")
+    create_index(Appointment, 'uq_appointment_doctor_slot')
+
+
+def run_migrations():
+    applied = {m.version for m in SchemaMigration.query.all()}
+    for version, name, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        func()
+        db.session.add(SchemaMigration(version=version, name=name))
+        db.session.commit()
+        print(f"Applied migration {version}: {name}")
+
+
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS doctor_search
+       USING fts5(full_name, department, qualification, prefix='2 3')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS patient_search
+       USING fts5(full_name, phone, prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS doctor_search_insert AFTER INSERT ON doctor BEGIN
+           INSERT INTO doctor_search (rowid, full_name, department, qualification)
+           VALUES (new.id, new.full_name,
+                   (SELECT name FROM department WHERE id = new.specialization_id), new.qualification);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS doctor_search_update AFTER UPDATE ON doctor BEGIN
+           DELETE FROM doctor_search WHERE rowid = old.id;
+           INSERT INTO doctor_search (rowid, full_name, department, qualification)
+           VALUES (new.id, new.full_name,
+                   (SELECT name FROM department WHERE id = new.specialization_id), new.qualification);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS doctor_search_delete AFTER DELETE ON doctor BEGIN
+           DELETE FROM doctor_search WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS department_search_update AFTER UPDATE OF name ON department BEGIN
+           UPDATE doctor_search SET department = new.name
+           WHERE rowid IN (SELECT id FROM doctor WHERE specialization_id = new.id);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS patient_search_insert AFTER INSERT ON patient BEGIN
+           INSERT INTO patient_search (rowid, full_name, phone) VALUES (new.id, new.full_name, new.phone);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS patient_search_update AFTER UPDATE ON patient BEGIN
+           DELETE FROM patient_search WHERE rowid = old.id;
+           INSERT INTO patient_search (rowid, full_name, phone) VALUES (new.id, new.full_name, new.phone);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS patient_search_delete AFTER DELETE ON patient BEGIN
+           DELETE FROM patient_search WHERE rowid = old.id;
+       END""",
+]
+
+
+@migration(3, 'full-text search index for doctors and patients')
+def create_search_index():
+    if not search_index_enabled():
+        return
+    conn = db.session.connection()
+    for ddl in SEARCH_INDEX_DDL:
+        conn.exec_driver_sql(ddl)
+    rebuild_search_index()
+
+
+def rebuild_search_index():
+    conn = db.session.connection()
+    conn.exec_driver_sql("DELETE FROM doctor_search")
+    conn.exec_driver_sql(
+        "INSERT INTO doctor_search (rowid, full_name, department, qualification) "
+        "SELECT doctor.id, doctor.full_name, department.name, doctor.qualification "
+        "FROM doctor LEFT JOIN department ON department.id = doctor.specialization_id")
+    conn.exec_driver_sql("DELETE FROM patient_search")
+    conn.exec_driver_sql(
+        "INSERT INTO patient_search (rowid, full_name, phone) SELECT id, full_name, phone FROM patient")
+    db.session.commit()
+
+
+@app.cli.command('bench-search')
+@click.argument('terms', nargs=-1)
+@click.option('--repeat', default=20, help='Runs per term and search path.')
+def bench_search(terms, repeat):
+    terms = terms or ('sha', 'kumar', '98')
+    like = lambda term: Patient.query.filter(
+        (Patient.full_name.contains(term)) | (Patient.phone.contains(term)))
+    print(f"{Patient.query.count()} patients")
+    for term in terms:
+        for label, build in (('LIKE', like), ('FTS5', lambda t: search_patients(Patient.query, t))):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                rows = build(term).all()
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            print(f"{label:5} {term!r:12} {len(rows):6d} rows  {elapsed:8.2f} ms")
+
+
+@migration(4, 'admin dashboard counters')
+def backfill_dashboard_stats():
+    recompute_dashboard_stats()
+
+
+@migration(5, 'patient history read model')
+def backfill_patient_history():
+    rebuild_patient_history()
+
+
+@migration(6, 'patient history outlives archived appointments')
+def drop_patient_history_fk():
+    # SQLite does not enforce the old constraint (foreign_keys is off); PostgreSQL does
+    conn = db.session.connection()
+    if conn.dialect.name == 'postgresql':
+        for fk in inspect(conn).get_foreign_keys('patient_history'):
+            conn.exec_driver_sql(f'ALTER TABLE patient_history DROP CONSTRAINT "{fk["name"]}"')
+
+
+@migration(7, 'archived ids are never handed out again')
+def autoincrement_archived_ids():
+    # PostgreSQL sequences never go back; SQLite without AUTOINCREMENT reuses max(id) + 1
+    conn = db.session.connection()
+    if conn.dialect.name != 'sqlite':
+        return
+    for live, archive in ARCHIVED_TABLES:
+        name = live.__tablename__
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).scalar()
+        if 'AUTOINCREMENT' not in ddl.upper():
+            rebuild_sqlite_table(conn, live.__table__)
+        last_id = max(conn.execute(select(db.func.max(model.id))).scalar() or 0 for model in (live, archive))
+        seq = conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = ?", (name,)).scalar()
+        if seq is None:
+            conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, last_id))
+        elif seq < last_id:
+            conn.exec_driver_sql("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (last_id, name))
+
+
+def rebuild_sqlite_table(conn, table):
+    """Recreate table from its model with the rows kept; SQLite cannot change a table's key in place."""
+    temp = f"{table.name}_rebuild"
+    ddl = str(CreateTable(table).compile(conn)).strip().replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {temp} ", 1)
+    columns = ', '.join(f'"{c.name}"' for c in table.columns)
+    conn.exec_driver_sql(ddl)
+    conn.exec_driver_sql(f'INSERT INTO {temp} ({columns}) SELECT {columns} FROM "{table.name}"')
+    conn.exec_driver_sql(f'DROP TABLE "{table.name}"')
+    conn.exec_driver_sql(f'ALTER TABLE {temp} RENAME TO "{table.name}"')
+    for index in table.indexes:
+        index.create(conn)
+
+
+@migration(8, 'sharded dashboard counters')
+def shard_dashboard_stats():
+    # derived data: recreate the table with the shard column and count again
+    conn = db.session.connection()
+    if 'shard' in {c['name'] for c in inspect(conn).get_columns('dashboard_stat')}:
+        return
+    DashboardStat.__table__.drop(conn)
+    DashboardStat.__table__.create(conn)
+    recompute_dashboard_stats()
+
+
+@migration(9, 'sharded table versions')
+def shard_table_versions():
+    # the totals must carry over: restarting at 0 would reissue ETags that clients still hold
+    conn = db.session.connection()
+    if 'shard' in {c['name'] for c in inspect(conn).get_columns('table_version')}:
+        return
+    rows = conn.exec_driver_sql("SELECT name, version, updated_at FROM table_version").all()
+    TableVersion.__table__.drop(conn)
+    TableVersion.__table__.create(conn)
+    if rows:
+        conn.execute(insert(TableVersion), [
+            {'name': name, 'shard': 0, 'version': version,
+             'updated_at': datetime.fromisoformat(updated_at) if isinstance(updated_at, str) else updated_at}
+            for name, version, updated_at in rows])
+
+
+@migration(10, 'live appointment counter')
+def backfill_live_appointments():
+    recompute_dashboard_stats()
+
+
+@app.cli.command('rebuild-history')
+@click.option('--patient', 'patient_id', type=int, help='Only rebuild this patient.')
+def rebuild_history(patient_id):
+    started = time.perf_counter()
+    rebuild_patient_history(patient_id)
+    count = PatientHistory.query.filter_by(patient_id=patient_id).count() if patient_id \
+        else PatientHistory.query.count()
+    print(f"Patient history rebuilt: {count} visits in {time.perf_counter() - started:.1f}s.")
+
+
+@app.cli.command('recompute-stats')
+def recompute_stats():
+    recompute_dashboard_stats()
+    print("Dashboard counters recomputed.")
+
+
+def sqlite_throughput(path, pragmas, seconds, readers, writers):
+    def connect():
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        for name, value in pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+
+    def read():
+        conn = connect()
+        while time.monotonic() < deadline:
+            conn.execute("SELECT COUNT(*) FROM bench WHERE doctor_id = ?", (counts['reads'] % 50,)).fetchone()
+            counts['reads'] += 1
+
+    def write():
+        conn = connect()
+        while time.monotonic() < deadline:
+            try:
+                conn.execute("INSERT INTO bench (doctor_id, note) VALUES (?, 'x')", (counts['writes'] % 50,))
+                counts['writes'] += 1
+            except sqlite3.OperationalError:
+                counts['locked'] += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + \
+        [threading.Thread(target=write) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {key: counts[key] / seconds for key in ('reads', 'writes', 'locked')}
+
+
+@app.cli.command('bench-sqlite')
+@click.option('--seconds', default=5.0)
+@click.option('--readers', default=4)
+@click.option('--writers', default=2)
+def bench_sqlite(seconds, readers, writers):
+    workdir = tempfile.mkdtemp()
+    try:
+        for label, pragmas in (('default', {'busy_timeout': 5000}), ('tuned', app.config['SQLITE_PRAGMAS'])):
+            path = os.path.join(workdir, f"{label}.db")
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE bench (id INTEGER PRIMARY KEY, doctor_id INTEGER, note TEXT)")
+            conn.execute("CREATE INDEX ix_bench_doctor ON bench (doctor_id)")
+            conn.executemany("INSERT INTO bench (doctor_id, note) VALUES (?, 'x')", ((i % 50,) for i in range(20000)))
+            conn.commit()
+            conn.close()
+            result = sqlite_throughput(path, pragmas, seconds, readers, writers)
+            print(f"{label:8} reads/s {result['reads']:10.0f}  writes/s {result['writes']:8.0f}"
+                  f"  locked/s {result['locked']:6.1f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+IMPORT_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+APPOINTMENT_STATUSES = ('Booked', 'Completed', 'Cancelled', 'No-show')
+
+
+def read_records(stream, fmt):
+    """Yield (line number, record, error) so one bad line is reported instead of aborting the import."""
+    if fmt == 'csv':
+        for line_no, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_no, {k: (v.strip() or None) if isinstance(v, str) else v for k, v in row.items()}, None
+        return
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"invalid JSON: {e}"
+            continue
+        if isinstance(record, dict):
+            yield line_no, record, None
+        else:
+            yield line_no, None, "expected a JSON object"
+
+
+def required(record, *fields):
+    missing = [f for f in fields if record.get(f) in (None, '')]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+
+def optional_int(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+
+
+def optional_bool(record, field, default):
+    # NDJSON carries true/false, CSV the text export-data wrote ("True"/"False")
+    value = record.get(field)
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', '1', 'yes'):
+        return True
+    if text in ('false', '0', 'no'):
+        return False
+    raise ValueError(f"{field} must be true or false")
+
+
+# werkzeug cannot parse it as a hash, so check_password_hash is False for every password
+UNUSABLE_PASSWORD = '!'
+
+
+def validate_person(record):
+    # export-data leaves hashes out, so re-imported people come without one and cannot log in yet
+    required(record, 'username', 'email', 'full_name')
+    return {
+        'username': str(record['username']),
+        'email': str(record['email']),
+        'password': str(record['password']) if record.get('password') not in (None, '') else None,
+        'full_name': str(record['full_name']),
+        'phone': record.get('phone'),
+        'is_active': optional_bool(record, 'is_active', True),
+    }
+
+
+def validate_patient(record):
+    row = validate_person(record)
+    row.update(
+        age=optional_int(record, 'age'),
+        gender=record.get('gender'),
+        address=record.get('address'),
+        blood_group=record.get('blood_group'),
+    )
+    return row
+
+
+def validate_doctor(record):
+    row = validate_person(record)
+    required(record, 'department')
+    row.update(
+        department=str(record['department']),
+        qualification=record.get('qualification'),
+        experience_years=optional_int(record, 'experience_years'),
+    )
+    return row
+
+
+def validate_appointment(record):
+    required(record, 'patient_username', 'doctor_username', 'date', 'time')
+    status = record.get('status') or 'Booked'
+    if status not in APPOINTMENT_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(APPOINTMENT_STATUSES)}")
+    try:
+        appointment_date = datetime.strptime(str(record['date']), '%Y-%m-%d').date()
+        appointment_time = datetime.strptime(str(record['time']), '%H:%M').time()
+    except ValueError:
+        raise ValueError("date must be YYYY-MM-DD and time HH:MM")
+    return {
+        'patient_username': str(record['patient_username']),
+        'doctor_username': str(record['doctor_username']),
+        'appointment_date': appointment_date,
+        'appointment_time': appointment_time,
+        'status': status,
+        'reason': record.get('reason'),
+    }
+
+
+def split_taken_users(rows):
+    """Reject rows whose username/email already exists in the database or earlier in the chunk."""
+    usernames = {row['username'] for _, row in rows}
+    emails = {row['email'] for _, row in rows}
+    taken = set(db.session.execute(select(User.username).where(User.username.in_(usernames))).scalars())
+    taken |= set(db.session.execute(select(User.email).where(User.email.in_(emails))).scalars())
+    accepted, errors = [], []
+    for line_no, row in rows:
+        if row['username'] in taken or row['email'] in taken:
+            errors.append((line_no, "username or email already exists"))
+        else:
+            taken.update((row['username'], row['email']))
+            accepted.append((line_no, row))
+    return accepted, errors
+
+
+def insert_users(rows, role):
+    now = datetime.now()
+    result = db.session.execute(insert(User).returning(User.id, User.username), [{
+        'username': row['username'], 'email': row['email'], 'password': row['password'],
+        'role': role, 'created_at': now,
+    } for _, row in rows])
+    return {username: user_id for user_id, username in result}
+
+
+def insert_patients(rows):
+    rows, errors = split_taken_users(rows)
+    if rows:
+        user_ids = insert_users(rows, 'patient')
+        db.session.execute(insert(Patient), [{
+            'user_id': user_ids[row['username']], 'full_name': row['full_name'], 'age': row['age'],
+            'gender': row['gender'], 'phone': row['phone'], 'address': row['address'],
+            'blood_group': row['blood_group'], 'is_active': row['is_active'],
+        } for _, row in rows])
+    return len(rows), errors
+
+
+def insert_doctors(rows):
+    rows, errors = split_taken_users(rows)
+    departments = dict(db.session.execute(select(Department.name, Department.id)).all())
+    known = []
+    for line_no, row in rows:
+        if row['department'] in departments:
+            known.append((line_no, row))
+        else:
+            errors.append((line_no, f"unknown department {row['department']!r}"))
+    if known:
+        user_ids = insert_users(known, 'doctor')
+        db.session.execute(insert(Doctor), [{
+            'user_id': user_ids[row['username']], 'full_name': row['full_name'],
+            'specialization_id': departments[row['department']], 'phone': row['phone'],
+            'qualification': row['qualification'], 'experience_years': row['experience_years'],
+            'is_active': row['is_active'],
+        } for _, row in known])
+    return len(known), errors
+
+
+def insert_appointments(rows):
+    patients = dict(db.session.execute(select(User.username, Patient.id).join(Patient, Patient.user_id == User.id)
+                                       .where(User.username.in_({row['patient_username'] for _, row in rows}))).all())
+    doctors = dict(db.session.execute(select(User.username, Doctor.id).join(Doctor, Doctor.user_id == User.id)
+                                      .where(User.username.in_({row['doctor_username'] for _, row in rows}))).all())
+    now = datetime.now()
+    values, errors = [], []
+    for line_no, row in rows:
+        if row['patient_username'] not in patients:
+            errors.append((line_no, f"unknown patient {row['patient_username']!r}"))
+        elif row['doctor_username'] not in doctors:
+            errors.append((line_no, f"unknown doctor {row['doctor_username']!r}"))
+        else:
+            values.append({
+                'patient_id': patients[row['patient_username']], 'doctor_id': doctors[row['doctor_username']],
+                'appointment_date': row['appointment_date'], 'appointment_time': row['appointment_time'],
+                'status': row['status'], 'reason': row['reason'], 'created_at': now,
+            })
+    if values:
+        db.session.execute(insert(Appointment), values)
+    return len(values), errors
+
+
+IMPORTERS = {
+    'patients': (validate_patient, insert_patients, ('user', 'patient')),
+    'doctors': (validate_doctor, insert_doctors, ('user', 'doctor')),
+    'appointments': (validate_appointment, insert_appointments, ('appointment',)),
+}
+
+
+def import_chunk(insert_rows, rows):
+    """Insert a chunk in one executemany; on a constraint conflict retry row by row to find the culprits."""
+    try:
+        with db.session.begin_nested():
+            return insert_rows(rows)
+    except IntegrityError:
+        imported, errors = 0, []
+        for line_no, row in rows:
+            try:
+                with db.session.begin_nested():
+                    count, row_errors = insert_rows([(line_no, row)])
+                imported += count
+                errors.extend(row_errors)
+            except IntegrityError as e:
+                errors.append((line_no, f"conflict: {e.orig}"))
+        return imported, errors
+
+
+@app.cli.command('import-data')
+@click.argument('entity', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, help='Rows per executemany and per commit.')
+@click.option('--workers', default=os.cpu_count() or 1, type=click.IntRange(min=1),
+              help='Processes used to hash passwords.')
+@click.option('--errors', 'error_file', type=click.File('w'), help='Write rejected lines here as NDJSON.')
+def import_data(entity, source, fmt, batch_size, workers, error_file):
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'ndjson')
+    validate, insert_rows, tables = IMPORTERS[entity]
+    imported = rejected = 0
+
+    def report(line_no, message):
+        nonlocal rejected
+        rejected += 1
+        if error_file:
+            error_file.write(json.dumps({'line': line_no, 'error': message}) + '\n')
+        elif rejected <= 20:
+            click.echo(f"line {line_no}: {message}", err=True)
+
+    records = read_records(source, fmt)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            chunk = list(itertools.islice(records, batch_size))
+            if not chunk:
+                break
+            rows = []
+            for line_no, record, error in chunk:
+                if error is None:
+                    try:
+                        rows.append((line_no, validate(record)))
+                        continue
+                    except ValueError as e:
+                        error = str(e)
+                report(line_no, error)
+
+            if rows and 'password' in rows[0][1]:
+                with_password = [row for _, row in rows if row['password'] is not None]
+                hashes = pool.map(generate_password_hash, [row['password'] for row in with_password],
+                                  itertools.repeat(hasher.method),
+                                  chunksize=max(len(with_password) // (workers * 4), 1))
+                for row, hashed in zip(with_password, hashes):
+                    row['password'] = hashed
+                for _, row in rows:
+                    row['password'] = row['password'] or UNUSABLE_PASSWORD
+
+            count, errors = import_chunk(insert_rows, rows) if rows else (0, [])
+            db.session.commit()
+            imported += count
+            for line_no, message in errors:
+                report(line_no, message)
+            click.echo(f"{imported} imported, {rejected} rejected", err=True)
+
+    # bulk inserts bypass the ORM flush hooks, so bring the derived data up to date once at the end
+    bump_table_versions(db.session.connection(), tables)
+    if entity == 'appointments':
+        rebuild_patient_history()
+    recompute_dashboard_stats()
+    click.echo(f"Done: {imported} {entity} imported, {rejected} rejected.")
+
+
+def export_query(entity):
+    if entity == 'patients':
+        return select(Patient.id, User.username, User.email, Patient.full_name, Patient.age, Patient.gender,
+                      Patient.phone, Patient.address, Patient.blood_group, Patient.is_active) \
+            .join(User, Patient.user_id == User.id).order_by(Patient.id)
+    if entity == 'doctors':
+        return select(Doctor.id, User.username, User.email, Doctor.full_name,
+                      Department.name.label('department'), Doctor.phone, Doctor.qualification,
+                      Doctor.experience_years, Doctor.is_active) \
+            .join(User, Doctor.user_id == User.id) \
+            .join(Department, Doctor.specialization_id == Department.id).order_by(Doctor.id)
+    patient_user, doctor_user = aliased(User), aliased(User)
+    return select(Appointment.id, patient_user.username.label('patient_username'),
+                  doctor_user.username.label('doctor_username'), Appointment.appointment_date.label('date'),
+                  Appointment.appointment_time.label('time'), Appointment.status, Appointment.reason) \
+        .join(Patient, Appointment.patient_id == Patient.id).join(patient_user, Patient.user_id == patient_user.id) \
+        .join(Doctor, Appointment.doctor_id == Doctor.id).join(doctor_user, Doctor.user_id == doctor_user.id) \
+        .order_by(Appointment.id)
+
+
+def export_value(value):
+    # dates as YYYY-MM-DD and times as HH:MM, matching what import-data reads
+    if hasattr(value, 'year'):
+        return value.isoformat()
+    if hasattr(value, 'hour'):
+        return value.strftime('%H:%M')
+    return value
+
+
+@app.cli.command('export-data')
+@click.argument('entity', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('target', type=click.File('w', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+def export_data(entity, target, fmt):
+    fmt = fmt or ('csv' if target.name.endswith('.csv') else 'ndjson')
+    # yield_per streams from a server-side cursor; only one batch is in memory at a time
+    result = db.session.execute(export_query(entity).execution_options(yield_per=EXPORT_BATCH_SIZE))
+    columns = list(result.keys())
+    writer = csv.writer(target) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+    count = 0
+    for row in result:
+        values = [export_value(v) for v in row]
+        if writer:
+            writer.writerow(values)
+        else:
+            target.write(json.dumps(dict(zip(columns, values))) + '\n')
+        count += 1
+    click.echo(f"Exported {count} {entity}.", err=True)
+
+
+@app.cli.command('bench-login')
+@click.option('--threads', default=8, help='Concurrent clients.')
+@click.option('--logins', default=40, help='Logins per client.')
+def bench_login(threads, logins):
+    username = f"bench-{os.getpid()}"
+    user = User(username=username, email=f"{username}@bench.invalid",
+                password=hasher.hash('bench-password'), role='admin')
+    db.session.add(user)
+    db.session.commit()
+    try:
+        def client_run(_):
+            client = app.test_client()
+            for _ in range(logins):
+                client.post('/login', data={'username': username, 'password': 'bench-password'})
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as clients:
+            list(clients.map(client_run, range(threads)))
+        elapsed = time.perf_counter() - started
+        print(f"{threads * logins} logins in {elapsed:.2f}s: {threads * logins / elapsed:.1f} logins/s "
+              f"({hasher.workers} hash workers, method {hasher.method})")
+    finally:
+        db.session.delete(user)
+        db.session.commit()
+
+
+# Representative queries for every route that filters on the indexed columns.
+def route_query_samples():
+    today = datetime.now().date()
+    week_end = today + timedelta(days=7)
+    booking_end = today + timedelta(days=BOOKING_WINDOW_DAYS)
+    doctor_ids = [1, 2, 3]
+    return {
+        'doctor profile lookup': Doctor.query.filter_by(user_id=1),
+        'patient profile lookup': Patient.query.filter_by(user_id=1),
+        'admin_dashboard upcoming': Appointment.query.filter(
+            Appointment.appointment_date >= today, Appointment.status == 'Booked'),
+        'admin_dashboard recent': Appointment.query.order_by(Appointment.created_at.desc()).limit(5),
+        'admin_appointments': Appointment.query.order_by(Appointment.appointment_date.desc()),
+        'patient history page': PatientHistory.query.filter(PatientHistory.patient_id == 1)
+            .order_by(PatientHistory.appointment_date.desc(), PatientHistory.appointment_id.desc()).limit(50),
+        'doctor_dashboard upcoming': Appointment.query.filter(
+            Appointment.doctor_id == 1, Appointment.appointment_date >= today,
+            Appointment.appointment_date <= week_end, Appointment.status == 'Booked'),
+        'doctor_dashboard patients': db.session.query(Patient).join(Appointment).filter(
+            Appointment.doctor_id == 1).distinct(),
+        'doctor_appointments': Appointment.query.filter_by(doctor_id=1)
+            .order_by(Appointment.appointment_date.desc()),
+        'doctor_availability': DoctorAvailability.query.filter(
+            DoctorAvailability.doctor_id == 1, DoctorAvailability.date >= today,
+            DoctorAvailability.date <= week_end),
+        # free_slots serves the booking page for one doctor and the doctor list for many
+        'free_slots weekly rules': rule_windows_query(doctor_ids, today, booking_end),
+        'free_slots availability': availability_windows_query(doctor_ids, today, booking_end),
+        'free_slots booked': booked_slots_query(doctor_ids, today, booking_end),
+        'patient_dashboard upcoming': Appointment.query.filter(
+            Appointment.patient_id == 1, Appointment.appointment_date >= today,
+            Appointment.status == 'Booked'),
+        'patient_appointments': Appointment.query.filter_by(patient_id=1)
+            .order_by(Appointment.appointment_date.desc()),
+        'treatment lookup': Treatment.query.filter_by(appointment_id=1),
+        'api_get_appointments page': Appointment.query.filter(
+            Appointment.appointment_date > today).order_by(Appointment.appointment_date, Appointment.id),
+    }
+
+
+def full_table_scans(query):
+    # render_postcompile expands IN lists into one parameter per value, as at run time
+    compiled = query.statement.compile(db.engine, compile_kwargs={'render_postcompile': True})
+    conn = db.session.connection()
+    if conn.dialect.name == 'postgresql':
+        plan = conn.exec_driver_sql('EXPLAIN ' + str(compiled), compiled.params).all()
+        return [row[0].strip() for row in plan if 'Seq Scan' in row[0]]
+    params = tuple(
+        value if isinstance(value, (int, float, str, type(None))) else str(value)
+        for value in (compiled.params[key] for key in compiled.positiontup)
+    )
+    plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).all()
+    return [row[-1] for row in plan if row[-1].startswith('SCAN ') and ' USING ' not in row[-1]]
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    failures = 0
+    for name, query in route_query_samples().items():
+        scans = full_table_scans(query)
+        if scans:
+            failures += 1
+            print(f"FAIL {name}: {'; '.join(scans)}")
+        else:
+            print(f"ok   {name}")
+    if failures:
+        raise SystemExit(f"{failures} route queries fall back to a full table scan")
+
+
+def create_check_people(label, doctors, patients):
+    """Throwaway doctors and patients for the check-* commands as ([(id, user_id)], [(id, user_id)]).
+
+    Doctors rotate over the departments; delete_check_people removes everything again.
+    """
+    departments = list(db.session.execute(select(Department.id).order_by(Department.id)).scalars())
+    prefix = f"{label}-{os.getpid()}"
+    # nobody logs in as them, so the password is a hash that never matches
+    users = [User(username=f"{prefix}-{n}", email=f"{prefix}-{n}@check.invalid", password=UNUSABLE_PASSWORD,
+                  role='doctor' if n < doctors else 'patient') for n in range(doctors + patients)]
+    db.session.add_all(users)
+    db.session.flush()
+    people = [Doctor(user_id=user.id, full_name=f"{label} doctor {n}", specialization_id=departments[n % len(departments)])
+              for n, user in enumerate(users[:doctors])]
+    people += [Patient(user_id=user.id, full_name=f"{label} patient {n}") for n, user in enumerate(users[doctors:])]
+    db.session.add_all(people)
+    db.session.commit()
+    ids = [(person.id, person.user_id) for person in people]
+    return ids[:doctors], ids[doctors:]
+
+
+def delete_check_people(doctors, patients):
+    # ORM deletes, so the counters, table versions and history follow
+    doctor_ids, patient_ids = [d for d, _ in doctors], [p for p, _ in patients]
+    appointments = Appointment.query.filter(or_(
+        Appointment.doctor_id.in_(doctor_ids), Appointment.patient_id.in_(patient_ids))).all()
+    for obj in Treatment.query.filter(Treatment.appointment_id.in_([a.id for a in appointments])).all() \
+            + appointments + DoctorAvailability.query.filter(DoctorAvailability.doctor_id.in_(doctor_ids)).all() \
+            + AvailabilityRule.query.filter(AvailabilityRule.doctor_id.in_(doctor_ids)).all():
+        db.session.delete(obj)
+    for person in [db.session.get(Doctor, d) for d in doctor_ids] + [db.session.get(Patient, p) for p in patient_ids]:
+        db.session.delete(person)
+        db.session.delete(person.user)
+    db.session.commit()
+
+
+def check_client(role, user_id, profile_id=None):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s.update(user_id=user_id, username='check', role=role, profile_id=profile_id)
+    return client
+
+
+def check_get(client, url):
+    # a request reuses an app context that is already pushed, so without a fresh one it would
+    # share g (g.patient, g.table_versions, ...) and the session with the command and the
+    # requests before it, and rows or lookups cached there would hide statements
+    with app.app_context():
+        return client.get(url)
+
+
+def count_statements(client, url):
+    statements = []
+    count = lambda *args: statements.append(1)
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        response = check_get(client, url)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    return response.status_code, len(statements)
+
+
+def add_check_visits(doctors, patients, first, count):
+    """Visits first..first+count-1 for doctors[0] and patients[0], each with a different counterpart,
+    so a lazy load per row shows up as one more statement per visit."""
+    today = datetime.now().date()
+    doctor_id, patient_id = doctors[0][0], patients[0][0]
+    completed = []
+    for k in range(first, first + count):
+        day = today + timedelta(days=1 + k % 6)
+        at = (DAY_START + timedelta(minutes=SLOT_MINUTES * (k // 6))).time()
+        past = Appointment(patient_id=patient_id, doctor_id=doctors[k][0], appointment_date=today - timedelta(days=k + 1),
+                           appointment_time=DAY_START.time(), status='Completed', reason='check')
+        db.session.add_all([
+            past,
+            # the doctor's week: one booking per patient
+            Appointment(patient_id=patients[k][0], doctor_id=doctor_id, appointment_date=day, appointment_time=at,
+                        reason='check'),
+            # the patient's upcoming visits: one per doctor
+            Appointment(patient_id=patient_id, doctor_id=doctors[k][0], appointment_date=day,
+                        appointment_time=(DAY_START + timedelta(minutes=SLOT_MINUTES * 8)).time(), reason='check'),
+        ])
+        db.session.flush()
+        db.session.add(Treatment(appointment_id=past.id, diagnosis='check', prescription='check', notes='check'))
+        completed.append(past.id)
+    db.session.flush()
+    refresh_history(Appointment.id.in_(completed))
+    db.session.commit()
+
+
+@app.cli.command('check-query-counts')
+@click.option('--visits', default=20, help='Visits in the second run; the first run has one.')
+def check_query_counts(visits):
+    """Fail when an appointment listing runs more SQL statements for more rows, i.e. lazy loads per row.
+
+    Adds throwaway doctors and patients with their visits and deletes them again afterwards.
+    """
+    doctors, patients = create_check_people('check-queries', visits, visits)
+    (doctor_id, doctor_user), (patient_id, patient_user) = doctors[0], patients[0]
+    clients = {
+        'admin': check_client('admin', 0),
+        'doctor': check_client('doctor', doctor_user, doctor_id),
+        'patient': check_client('patient', patient_user, patient_id),
+    }
+    targets = [
+        ('admin_dashboard', 'admin', '/admin/dashboard'),
+        ('admin_appointments', 'admin', '/admin/appointments'),
+        ('admin_patient_history', 'admin', f'/admin/patient/{patient_id}/history'),
+        ('doctor_dashboard', 'doctor', '/doctor/dashboard'),
+        ('doctor_appointments', 'doctor', '/doctor/appointments'),
+        ('doctor_patient_history', 'doctor', f'/doctor/patient/history/{patient_id}'),
+        ('patient_dashboard', 'patient', '/patient/dashboard'),
+        ('patient_appointments', 'patient', '/patient/appointments'),
+        ('patient_history', 'patient', '/patient/history'),
+    ]
+    # a cached fragment would skip exactly the template code that triggers lazy loads
+    fragment_cache, app.config['FRAGMENT_CACHE'] = app.config['FRAGMENT_CACHE'], False
+    try:
+        runs = []
+        for first, count in ((0, 1), (1, visits - 1)):
+            add_check_visits(doctors, patients, first, count)
+            run = {}
+            for name, role, url in targets:
+                check_get(clients[role], url)  # warm-up: template compilation and cache fills
+                run[name] = count_statements(clients[role], url)
+            runs.append(run)
+    finally:
+        app.config['FRAGMENT_CACHE'] = fragment_cache
+        delete_check_people(doctors, patients)
+
+    failures = 0
+    for name, _, _ in targets:
+        (status_one, one), (status_many, many) = runs[0][name], runs[1][name]
+        if status_one != 200 or status_many != 200:
+            failures += 1
+            print(f"FAIL {name}: returned {status_one} / {status_many}")
+        elif one != many:
+            failures += 1
+            print(f"FAIL {name}: {one} statements with 1 visit, {many} with {visits}")
+        else:
+            print(f"ok   {name}: {one} statements with 1 and {visits} visits")
+    if failures:
+        raise SystemExit(f"{failures} listing views run more statements for more rows")
+
+
+@app.cli.command('check-booking-race')
+@click.option('--threads', default=16, help='Patients booking the same slot at the same moment.')
+@click.option('--slots', default=8, help='Slots contended, one after another.')
+def check_booking_race(threads, slots):
+    """Fail if patients booking one slot concurrently ever end up with more than one live appointment.
+
+    Adds a throwaway doctor, patients and availability and deletes them again afterwards.
+    """
+    doctors, patients = create_check_people('check-booking', 1, threads)
+    doctor_id = doctors[0][0]
+    day = datetime.now().date() + timedelta(days=1)
+    db.session.add(DoctorAvailability(doctor_id=doctor_id, date=day, start_time=DAY_START.time(),
+                                      end_time=(DAY_START + timedelta(minutes=SLOT_MINUTES * slots)).time()))
+    db.session.commit()
+    clients = [check_client('patient', user_id, patient_id) for patient_id, user_id in patients]
+    url = f'/patient/book-appointment/{doctor_id}'
+    try:
+        outcomes = []
+        for n in range(slots):
+            slot = (datetime.combine(day, DAY_START.time()) + timedelta(minutes=SLOT_MINUTES * n)).strftime('%Y-%m-%d %H:%M')
+            start = threading.Barrier(threads)
+
+            def book(client):
+                start.wait()
+                response = client.post(url, data={'slot': slot, 'reason': 'check-booking-race'})
+                if response.status_code != 302:
+                    return 'error'
+                return 'booked' if response.location.endswith('/patient/appointments') else 'refused'
+
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                outcomes.append((slot, Counter(pool.map(book, clients))))
+        db.session.remove()
+        doubled = db.session.execute(
+            select(Appointment.appointment_date, Appointment.appointment_time, db.func.count())
+            .where(Appointment.doctor_id == doctor_id, Appointment.status != 'Cancelled')
+            .group_by(Appointment.appointment_date, Appointment.appointment_time)
+            .having(db.func.count() > 1)).all()
+    finally:
+        delete_check_people(doctors, patients)
+
+    failures = len(doubled)
+    for slot, counts in outcomes:
+        ok = counts['booked'] == 1 and not counts['error']
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {slot}: {counts['booked']} booked, {counts['refused']} refused, "
+              f"{counts['error']} errors")
+    for day, at, count in doubled:
+        print(f"FAIL {day} {at}: {count} live appointments")
+    if failures:
+        raise SystemExit(f"{len(doubled)} double-booked slots, {failures - len(doubled)} slots without exactly one booking")
+    print(f"No double bookings: {slots} slots, {threads} concurrent patients each.")
+
+
+GENERATE_BATCH_SIZE = 5000
+DAY_START = datetime.strptime('09:00', '%H:%M')
+SLOTS_PER_DAY = 16
+
+
+def fake_people(kind, count, offset, seed):
+    """Yield user+profile dicts for generated doctors or patients; usernames are gen-<kind>-<n>."""
+    import factory
+    import factory.random
+
+    factory.random.reseed_random(seed)
+
+    class PersonFactory(factory.DictFactory):
+        full_name = factory.Faker('name')
+        phone = factory.Faker('numerify', text='9#########')
+        username = None
+        email = factory.LazyAttribute(lambda o: f"{o.username}@example.test")
+
+    class PatientFactory(PersonFactory):
+        age = factory.Faker('pyint', min_value=1, max_value=95)
+        gender = factory.Faker('random_element', elements=('Male', 'Female', 'Other'))
+        address = factory.Faker('address')
+        blood_group = factory.Faker('random_element', elements=('A+', 'A-', 'B+', 'B-', 'O+', 'O-', 'AB+', 'AB-'))
+
+    class DoctorFactory(PersonFactory):
+        qualification = factory.Faker('random_element', elements=('MBBS', 'MBBS, MD', 'MBBS, MS', 'MBBS, DNB'))
+        experience_years = factory.Faker('pyint', min_value=1, max_value=40)
+
+    person = DoctorFactory if kind == 'doctor' else PatientFactory
+    for n in range(offset, offset + count):
+        yield person(username=f"gen-{kind}-{n}")
+
+
+def generate_people(kind, count, password, seed, departments=None):
+    offset = db.session.query(db.func.count(User.id)).scalar()
+    people = fake_people(kind, count, offset, seed)
+    rng = random.Random(seed)
+    ids = []
+    while True:
+        batch = list(itertools.islice(people, GENERATE_BATCH_SIZE))
+        if not batch:
+            break
+        now = datetime.now()
+        user_ids = dict((name, user_id) for user_id, name in db.session.execute(
+            insert(User).returning(User.id, User.username), [{
+                'username': p['username'], 'email': p['email'], 'password': password,
+                'role': kind, 'created_at': now,
+            } for p in batch]))
+        if kind == 'doctor':
+            rows = [{
+                'user_id': user_ids[p['username']], 'full_name': p['full_name'], 'phone': p['phone'],
+                'specialization_id': rng.choice(departments), 'qualification': p['qualification'],
+                'experience_years': p['experience_years'], 'is_active': True,
+            } for p in batch]
+            ids.extend(db.session.execute(insert(Doctor).returning(Doctor.id), rows).scalars())
+        else:
+            rows = [{
+                'user_id': user_ids[p['username']], 'full_name': p['full_name'], 'age': p['age'],
+                'gender': p['gender'], 'phone': p['phone'], 'address': p['address'],
+                'blood_group': p['blood_group'], 'is_active': True,
+            } for p in batch]
+            ids.extend(db.session.execute(insert(Patient).returning(Patient.id), rows).scalars())
+        db.session.commit()
+        click.echo(f"{len(ids)} {kind}s", err=True)
+    return ids
+
+
+def generate_appointments(count, doctor_ids, patient_ids, past_share, seed):
+    """Fill each doctor's 30-minute grid day by day, so no two live bookings share a slot."""
+    import faker
+
+    fake = faker.Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    reasons = [fake.sentence(nb_words=6) for _ in range(200)]
+    notes = [(fake.sentence(nb_words=4), fake.sentence(nb_words=5), fake.paragraph(nb_sentences=2))
+             for _ in range(200)]
+    today = datetime.now().date()
+    days = math.ceil(count / len(doctor_ids) / SLOTS_PER_DAY)
+    first_day = today - timedelta(days=int(days * past_share))
+    created = 0
+    while created < count:
+        now = datetime.now()
+        rows = []
+        for k in range(created, min(created + GENERATE_BATCH_SIZE, count)):
+            slot = k // len(doctor_ids)
+            day = first_day + timedelta(days=slot // SLOTS_PER_DAY)
+            if day < today:
+                status = 'Completed' if rng.random() < 0.85 else 'Cancelled'
+            else:
+                status = 'Booked' if rng.random() < 0.9 else 'Cancelled'
+            rows.append({
+                'patient_id': rng.choice(patient_ids), 'doctor_id': doctor_ids[k % len(doctor_ids)],
+                'appointment_date': day,
+                'appointment_time': (DAY_START + timedelta(minutes=SLOT_MINUTES * (slot % SLOTS_PER_DAY))).time(),
+                'status': status, 'reason': rng.choice(reasons), 'created_at': now,
+            })
+        result = db.session.execute(insert(Appointment).returning(Appointment.id, Appointment.status), rows)
+        treatments = []
+        for appointment_id, status in result:
+            if status == 'Completed':
+                diagnosis, prescription, note = rng.choice(notes)
+                treatments.append({'appointment_id': appointment_id, 'diagnosis': diagnosis,
+                                   'prescription': prescription, 'notes': note, 'created_at': now})
+        if treatments:
+            db.session.execute(insert(Treatment), treatments)
+        db.session.commit()
+        created += len(rows)
+        click.echo(f"{created} appointments", err=True)
+
+
+@app.cli.command('generate-data')
+@click.option('--doctors', default=50, help='Doctors to create.')
+@click.option('--patients', default=1000, help='Patients to create.')
+@click.option('--appointments', default=10000, help='Appointments to spread over the new doctors.')
+@click.option('--past-share', default=0.9, help='Fraction of appointment days before today.')
+@click.option('--password', default='password', help='Password shared by every generated user.')
+@click.option('--seed', default=1)
+def generate_data(doctors, patients, appointments, past_share, password, seed):
+    """Fill the database with synthetic hospital data, e.g. --doctors 1000 --patients 500000 --appointments 5000000."""
+    departments = list(db.session.execute(select(Department.id)).scalars())
+    if not departments:
+        raise SystemExit("No departments; run the app once to seed them.")
+    if appointments and not (doctors and patients):
+        raise SystemExit("--appointments needs --doctors and --patients in the same run.")
+    started = time.perf_counter()
+    # one hash shared by everyone: hashing 500k passwords would dominate the run
+    password = hasher.hash(password)
+    doctor_ids = generate_people('doctor', doctors, password, seed, departments)
+    patient_ids = generate_people('patient', patients, password, seed + 1)
+
+    today = datetime.now().date()
+    for offset in range(0, len(doctor_ids), GENERATE_BATCH_SIZE):
+        db.session.execute(insert(AvailabilityRule), [{
+            'doctor_id': doctor_id, 'weekdays': 0b0111111, 'valid_from': today, 'valid_until': None,
+            'start_time': DAY_START.time(), 'end_time': (DAY_START + timedelta(minutes=SLOT_MINUTES * SLOTS_PER_DAY)).time(),
+            'created_at': datetime.now(),
+        } for doctor_id in doctor_ids[offset:offset + GENERATE_BATCH_SIZE]])
+    db.session.commit()
+    if appointments:
+        generate_appointments(appointments, doctor_ids, patient_ids, past_share, seed)
+
+    # bulk inserts bypass the ORM flush hooks, so bring the derived data up to date once at the end
+    bump_table_versions(db.session.connection(), VERSIONED_TABLES)
+    rebuild_patient_history()
+    recompute_dashboard_stats()
+    click.echo(f"Generated {len(doctor_ids)} doctors, {len(patient_ids)} patients and {appointments} appointments "
+               f"in {time.perf_counter() - started:.1f}s.")
+
+
+def serialize_appointments_entities(limit):
+    appointments = appointment_query('patient', 'doctor') \
+        .order_by(Appointment.appointment_date, Appointment.id).limit(limit).all()
+    return json.dumps([appointment_to_dict(a) for a in appointments], sort_keys=True)
+
+
+def serialize_appointments_rows(limit):
+    rows = db.session.execute(appointment_rows().order_by(Appointment.appointment_date, Appointment.id).limit(limit))
+    return app.json.dumps([appointment_row_to_dict(row) for row in rows])
+
+
+@app.cli.command('bench-serializers')
+@click.option('--rows', default=100000, help='Appointments serialised per run.')
+@click.option('--repeat', default=3)
+def bench_serializers(rows, repeat):
+    """Compare ORM entities + json against row projections + the app's JSON encoder for the appointments API."""
+    print(f"{Appointment.query.count()} appointments, serialising {rows} per run, "
+          f"encoder {type(app.json).__name__}")
+    for label, serialize in (('entities', serialize_appointments_entities), ('rows', serialize_appointments_rows)):
+        timings = []
+        for _ in range(repeat):
+            db.session.remove()
+            started = time.perf_counter()
+            body = serialize(rows)
+            timings.append(time.perf_counter() - started)
+        db.session.remove()
+        tracemalloc.start()
+        serialize(rows)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        db.session.remove()
+        print(f"{label:9} {min(timings) * 1000:9.1f} ms  peak {peak / 2 ** 20:8.1f} MiB  {len(body) / 2 ** 20:6.1f} MiB JSON")
+
+
+@app.cli.command('bench-fragments')
+@click.option('--repeat', default=50, help='Timed requests per page and mode.')
+def bench_fragments(repeat):
+    """Template render time of the fragment-cached pages with the cache off and on."""
+    sessions, targets = bench_targets()
+    pages = ('admin_dashboard', 'admin_doctors', 'doctor_dashboard', 'patient_doctors')
+    render_times = []
+    started = []
+    before_render_template.connect(lambda *args, **kwargs: started.append(time.perf_counter()), app, weak=False)
+    template_rendered.connect(
+        lambda *args, **kwargs: render_times.append((time.perf_counter() - started.pop()) * 1000), app, weak=False)
+
+    for name, role, url in targets:
+        if name not in pages:
+            continue
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s.update(sessions[role])
+        results = []
+        for enabled in (False, True):
+            app.config['FRAGMENT_CACHE'] = enabled
+            client.get(url)  # warm-up: template compilation and, when enabled, the fragment fill
+            render_times.clear()
+            request_times = []
+            for _ in range(repeat):
+                begin = time.perf_counter()
+                client.get(url)
+                request_times.append((time.perf_counter() - begin) * 1000)
+            results.append((percentile(render_times, 50), percentile(request_times, 50)))
+        (render_off, request_off), (render_on, request_on) = results
+        print(f"{name:18} render p50 {render_off:7.2f} -> {render_on:7.2f} ms   "
+              f"request p50 {request_off:7.2f} -> {request_on:7.2f} ms")
+    app.config['FRAGMENT_CACHE'] = True
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def bench_targets():
+    """(name, role, url) for every GET page and API endpoint, pointed at ids that exist."""
+    doctor_id, doctor_user = db.session.execute(
+        select(Doctor.id, Doctor.user_id).where(Doctor.is_active == True).order_by(Doctor.id).limit(1)).first()
+    patient_id, patient_user = db.session.execute(
+        select(Patient.id, Patient.user_id).join(Appointment).group_by(Patient.id)
+        .order_by(db.func.count(Appointment.id).desc()).limit(1)).first()
+    appointment_id = db.session.execute(select(Appointment.id).order_by(Appointment.id).limit(1)).scalar()
+    sessions = {
+        'admin': {'user_id': 0, 'username': 'bench', 'role': 'admin'},
+        'doctor': {'user_id': doctor_user, 'username': 'bench', 'role': 'doctor', 'profile_id': doctor_id},
+        'patient': {'user_id': patient_user, 'username': 'bench', 'role': 'patient', 'profile_id': patient_id},
+    }
+    targets = [
+        ('admin_dashboard', 'admin', '/admin/dashboard'),
+        ('admin_doctors', 'admin', '/admin/doctors'),
+        ('admin_doctors search', 'admin', '/admin/doctors?search=sha'),
+        ('admin_patients', 'admin', '/admin/patients'),
+        ('admin_patients search', 'admin', '/admin/patients?search=kumar'),
+        ('admin_appointments', 'admin', '/admin/appointments'),
+        ('admin_patient_history', 'admin', f'/admin/patient/{patient_id}/history'),
+        ('doctor_dashboard', 'doctor', '/doctor/dashboard'),
+        ('doctor_appointments', 'doctor', '/doctor/appointments'),
+        ('doctor_patient_history', 'doctor', f'/doctor/patient/history/{patient_id}'),
+        ('doctor_availability', 'doctor', '/doctor/availability'),
+        ('patient_dashboard', 'patient', '/patient/dashboard'),
+        ('patient_doctors', 'patient', '/patient/doctors'),
+        ('patient_doctor_detail', 'patient', f'/patient/doctor/{doctor_id}'),
+        ('patient_book_appointment', 'patient', f'/patient/book-appointment/{doctor_id}'),
+        ('patient_appointments', 'patient', '/patient/appointments'),
+        ('patient_history', 'patient', '/patient/history'),
+        ('api_get_appointments', 'admin', '/api/appointments'),
+        ('api_get_appointments limit=1000', 'admin', '/api/appointments?limit=1000'),
+        ('api_get_appointment', 'admin', f'/api/appointment/{appointment_id}'),
+        ('api_get_doctors', 'admin', '/api/doctors'),
+        ('api_get_patients', 'admin', '/api/patients'),
+    ]
+    return sessions, targets
+
+
+def bench_route(client, url, repeat):
+    queries = []
+    count = lambda *args: queries.append(1)
+    client.get(url)  # warm-up: template compilation and cache fill
+    timings = []
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise SystemExit(f"{url} returned {response.status_code}")
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    return {
+        'p50': round(percentile(timings, 50), 3), 'p95': round(percentile(timings, 95), 3),
+        'p99': round(percentile(timings, 99), 3), 'queries': len(queries) // repeat,
+    }
+
+
+@app.cli.command('bench-routes')
+@click.option('--repeat', default=50, help='Timed requests per route.')
+@click.option('--baseline', 'baseline_path', default='bench-baseline.json', help='JSON file with earlier results.')
+@click.option('--threshold', default=0.2, help='Allowed p50/p95 slowdown against the baseline, as a fraction.')
+@click.option('--update', is_flag=True, help='Write this run as the new baseline instead of comparing.')
+def bench_routes(repeat, baseline_path, threshold, update):
+    sessions, targets = bench_targets()
+    clients = {}
+    for role, values in sessions.items():
+        clients[role] = app.test_client()
+        with clients[role].session_transaction() as s:
+            s.update(values)
+    results = {}
+    for name, role, url in targets:
+        results[name] = bench_route(clients[role], url, repeat)
+        r = results[name]
+        print(f"{name:34} p50 {r['p50']:8.2f} ms  p95 {r['p95']:8.2f} ms  p99 {r['p99']:8.2f} ms  "
+              f"{r['queries']:3d} queries")
+
+    if update or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {baseline_path}.")
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    failures = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        for key in ('p50', 'p95'):
+            if current[key] > base[key] * (1 + threshold):
+                failures.append(f"{name}: {key} {base[key]:.2f} -> {current[key]:.2f} ms")
+        if current['queries'] > base['queries']:
+            failures.append(f"{name}: queries {base['queries']} -> {current['queries']}")
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        raise SystemExit(f"{len(failures)} regressions against {baseline_path}")
+    print(f"No regressions against {baseline_path} (threshold {threshold:.0%}).")
+
+
 def init_db():
     with app.app_context():
         db.create_all()
+        run_migrations()
         
         if Department.query.count()==0:
             departments = [